@@ -0,0 +1,207 @@
+"""Async views for the hottest read endpoints, served under ASGI
+
+Django 3.2 has no async ORM, so each query runs in a worker thread of
+its own through sync_to_async and the independent ones, such as the
+page count and the page rows or the prefetches of the page, are awaited
+together. Only GET is served here, other methods and everything not
+listed in urlpatterns go to the regular viewsets.
+"""
+import asyncio
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.db import close_old_connections
+from django.db.models import prefetch_related_objects
+from django.urls import path, re_path
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.generics import get_object_or_404
+from rest_framework.response import Response
+from rest_framework.viewsets import ModelViewSet
+
+from api.mixins import CachedListMixin, ConditionalGetMixin
+from api.views import IngredientViewSet, RecipesViewSet, TagViewSet
+
+from .utils import shopping_list
+
+LIST = {'get': 'list', 'post': 'create'}
+DETAIL = {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+          'delete': 'destroy'}
+
+
+async def db(func, *args, **kwargs):
+    """Run blocking ORM code in a worker thread with its own connection"""
+    def run():
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return await sync_to_async(run, thread_sensitive=False)()
+
+
+async def prefetch(instances, lookups):
+    if not instances:
+        return
+    # every lookup fills the cache of the same instances from its own
+    # thread, so the cache has to exist before they start
+    for instance in instances:
+        instance._prefetched_objects_cache = {}
+    await asyncio.gather(*(
+        db(prefetch_related_objects, instances, lookup)
+        for lookup in lookups
+    ))
+
+
+def prepare(viewset, actions, initkwargs, request, kwargs):
+    """The viewset as DRF dispatch sets it up, with an early response
+
+    The response is the 304 of a matching If-None-Match or the error of
+    authentication, permission and throttle checks.
+    """
+    view = viewset(**initkwargs)
+    view.action_map = actions
+    view.action = actions['get']
+    view.args = ()
+    view.kwargs = kwargs
+    request = view.initialize_request(request, **kwargs)
+    view.request = request
+    view.headers = view.default_response_headers
+    view.etag = None
+    try:
+        view.initial(request, **kwargs)
+        if isinstance(view, ConditionalGetMixin):
+            view.etag = view.get_etag(request)
+            if view.is_not_modified(request, view.etag):
+                return view, Response(status=status.HTTP_304_NOT_MODIFIED)
+    except Exception as exc:
+        return view, view.handle_exception(exc)
+    return view, None
+
+
+def finish(view, response):
+    if view.etag and response.status_code in (status.HTTP_200_OK,
+                                              status.HTTP_304_NOT_MODIFIED):
+        response['ETag'] = view.etag
+    response = view.finalize_response(view.request, response)
+    if hasattr(response, 'render'):
+        response.render()
+    return response
+
+
+def async_view(viewset, actions, **initkwargs):
+    """GET through the async handler, other methods through the viewset"""
+    initkwargs = {'detail': actions is DETAIL, **initkwargs}
+
+    def decorator(handler):
+        fallback = viewset.as_view(actions, **initkwargs)
+
+        @wraps(handler)
+        async def view(request, **kwargs):
+            if request.method != 'GET':
+                return await db(fallback, request, **kwargs)
+            drf_view, response = await db(
+                prepare, viewset, actions, initkwargs, request, kwargs)
+            if response is None:
+                try:
+                    response = await handler(drf_view, **kwargs)
+                except Exception as exc:
+                    response = await db(drf_view.handle_exception, exc)
+            return await db(finish, drf_view, response)
+
+        # csrf_exempt() would hide the coroutine from the handler
+        view.csrf_exempt = True
+        return view
+    return decorator
+
+
+async def paginate(view, queryset, page_size, number):
+    """The page with its count and rows queried at once"""
+    paginator = view.paginator
+    offset = (number - 1) * page_size
+    count, rows = await asyncio.gather(
+        db(queryset.count),
+        db(list, queryset[offset:offset + page_size]),
+    )
+    django_paginator = paginator.django_paginator_class(queryset, page_size)
+    django_paginator.count = count
+    try:
+        page = django_paginator.page(number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(
+            page_number=number, message=str(exc)))
+    page.object_list = rows
+    paginator.page = page
+    paginator.request = view.request
+    paginator.keyset = False
+    return page
+
+
+async def serialize(view, instances, many=False):
+    return await db(lambda: view.get_serializer(instances, many=many).data)
+
+
+@async_view(RecipesViewSet, LIST, basename='recipes')
+async def recipe_list(view):
+    request = view.request
+    paginator = view.paginator
+    page_size = paginator.get_page_size(request)
+    number = request.query_params.get(paginator.page_query_param, '1')
+    if page_size and (paginator.cursor_query_param in request.query_params
+                      or not number.isdigit() or int(number) < 1):
+        # keyset pages, ?page=last and invalid numbers take the sync path
+        return await db(ModelViewSet.list, view, request)
+    queryset = await db(view.filter_queryset, view.get_queryset())
+    queryset = queryset.prefetch_related(None)
+    page = None
+    if page_size:
+        page = await paginate(view, queryset, page_size, int(number))
+    recipes = await db(list, queryset) if page is None else page.object_list
+    await prefetch(recipes, queryset.list_prefetches(request.user))
+    data = await serialize(view, recipes, many=True)
+    if page is None:
+        return Response(data)
+    return view.paginator.get_paginated_response(data)
+
+
+@async_view(RecipesViewSet, DETAIL, basename='recipes')
+async def recipe_detail(view, pk):
+    queryset = await db(view.filter_queryset, view.get_queryset())
+    recipe = await db(get_object_or_404, queryset.prefetch_related(None),
+                      pk=pk)
+    await prefetch([recipe], queryset.list_prefetches(view.request.user))
+    view.check_object_permissions(view.request, recipe)
+    return Response(await serialize(view, recipe))
+
+
+@async_view(RecipesViewSet, {'get': 'download_shopping_cart'},
+            basename='recipes',
+            **RecipesViewSet.download_shopping_cart.kwargs)
+async def download_shopping_cart(view):
+    # ASGI iterates streaming content in the event loop, where the ORM
+    # is not allowed, so the rows are read up front
+    servings = view.get_servings()
+    return view.shopping_list_response(
+        await db(list, shopping_list(view.request.user, servings)))
+
+
+@async_view(TagViewSet, LIST, basename='tags')
+async def tag_list(view):
+    return await db(CachedListMixin.list, view, view.request)
+
+
+@async_view(IngredientViewSet, LIST, basename='ingredients')
+async def ingredient_list(view):
+    return await db(CachedListMixin.list, view, view.request)
+
+
+urlpatterns = [
+    path('recipes/', recipe_list, name='recipes-list'),
+    path('recipes/download_shopping_cart/', download_shopping_cart,
+         name='recipes-download-shopping-cart'),
+    re_path(r'^recipes/(?P<pk>[0-9]+)/$', recipe_detail,
+            name='recipes-detail'),
+    path('tags/', tag_list, name='tags-list'),
+    path('ingredients/', ingredient_list, name='ingredients-list'),
+]
@@ -0,0 +1,118 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import authentication
+from rest_framework.authtoken.models import Token
+
+from recipes.cache import SHARED_CACHE
+
+from .metrics import registry
+
+
+class TokenCache:
+    """Token to user mapping in a process-local LRU over the shared cache
+
+    Every entry is stored with the generation of its token, which lives
+    in the shared cache and is bumped on logout, password change and any
+    other save of the user, so the entry goes stale in every process at
+    once. The generation is read before the database and bumped again
+    when the revoking transaction commits, so an entry cached by a
+    request that still saw the revoked token is stale after the commit.
+    The cached user may hold an old recipes_count, which User.save
+    therefore leaves alone.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = OrderedDict()
+
+    def make_key(self, key):
+        return f'auth:token:{sha256(key.encode()).hexdigest()}'
+
+    def generation(self, key):
+        shared = caches[SHARED_CACHE]
+        generation_key = f'{self.make_key(key)}:generation'
+        generation = shared.get(generation_key)
+        if generation is None:
+            shared.add(generation_key, time.time_ns(),
+                       settings.TOKEN_CACHE_TIMEOUT)
+            generation = shared.get(generation_key)
+        return generation
+
+    def get(self, key):
+        cache_key = self.make_key(key)
+        with self.lock:
+            entry = self.local.get(cache_key)
+            if entry is not None:
+                self.local.move_to_end(cache_key)
+        if entry is not None and entry[2] > time.monotonic():
+            result = 'local_hit'
+            user, generation, _ = entry
+        else:
+            result = 'shared_hit'
+            user, generation = (caches[SHARED_CACHE].get(cache_key)
+                                or (None, None))
+        if user is None or generation != self.generation(key):
+            registry.inc('foodgram_token_cache_requests_total',
+                         result='miss')
+            return None
+        if result == 'shared_hit':
+            self.store_local(cache_key, user, generation)
+        registry.inc('foodgram_token_cache_requests_total', result=result)
+        # requests must not share the instance they may change
+        return copy.copy(user)
+
+    def set(self, key, user, generation):
+        cache_key = self.make_key(key)
+        caches[SHARED_CACHE].set(cache_key, (user, generation),
+                                 settings.TOKEN_CACHE_TIMEOUT)
+        self.store_local(cache_key, user, generation)
+
+    def store_local(self, cache_key, user, generation):
+        expires = time.monotonic() + settings.TOKEN_CACHE_TIMEOUT
+        with self.lock:
+            self.local[cache_key] = (user, generation, expires)
+            self.local.move_to_end(cache_key)
+            while len(self.local) > settings.TOKEN_CACHE_SIZE:
+                self.local.popitem(last=False)
+
+    def invalidate(self, key):
+        cache_key = self.make_key(key)
+        shared = caches[SHARED_CACHE]
+        try:
+            shared.incr(f'{cache_key}:generation')
+        except ValueError:
+            shared.set(f'{cache_key}:generation', time.time_ns(),
+                       settings.TOKEN_CACHE_TIMEOUT)
+        shared.delete(cache_key)
+        with self.lock:
+            self.local.pop(cache_key, None)
+
+
+token_cache = TokenCache()
+
+
+class TokenAuthentication(authentication.TokenAuthentication):
+    """Token authentication served from token_cache
+
+    Reports its latency and the cache hits and misses to the metrics.
+    """
+
+    def authenticate_credentials(self, key):
+        start = time.perf_counter()
+        try:
+            user = token_cache.get(key)
+            if user is not None:
+                return user, Token(key=key, user=user)
+            generation = token_cache.generation(key)
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user, generation)
+            return user, token
+        finally:
+            registry.observe('foodgram_token_auth_duration_seconds',
+                             time.perf_counter() - start)
@@ -0,0 +1,59 @@
+import base64
+import binascii
+import io
+import uuid
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+
+class HeaderCheckedBase64ImageField(Base64ImageField):
+    """Base64 image checked by its header only
+
+    The full decode happens once, off the request, when the thumbnail
+    workers render the image.
+    """
+
+    def to_internal_value(self, base64_data):
+        if base64_data in self.EMPTY_VALUES:
+            return None
+        if not isinstance(base64_data, str):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        if ';base64,' in base64_data:
+            base64_data = base64_data.split(';base64,', 1)[1]
+        try:
+            decoded_file = base64.b64decode(base64_data)
+            with Image.open(io.BytesIO(decoded_file)) as image:
+                extension = image.format.lower()
+        except (binascii.Error, ValueError, OSError,
+                Image.DecompressionBombError):
+            raise ValidationError(self.INVALID_FILE_MESSAGE)
+        extension = 'jpg' if extension == 'jpeg' else extension
+        if extension not in self.ALLOWED_TYPES:
+            raise ValidationError(self.INVALID_TYPE_MESSAGE)
+        return SimpleUploadedFile(name=f'{uuid.uuid4()}.{extension}',
+                                  content=decoded_file)
+
+
+class ThumbnailsField(serializers.ReadOnlyField):
+    """Recipe thumbnail urls by size and format, empty until rendered"""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        storage = recipe.image.storage
+        request = self.context.get('request')
+        thumbnails = {}
+        for size, formats in recipe.thumbnails.get('sizes', {}).items():
+            thumbnails[size] = {}
+            for extension, name in formats.items():
+                url = storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                thumbnails[size][extension] = url
+        return thumbnails
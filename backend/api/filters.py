@@ -7,7 +7,10 @@ User = get_user_model()
 
 
 class IngredientFilter(FilterSet):
-    name = filters.CharFilter(lookup_expr='startswith')
+    name = filters.CharFilter(method='get_name')
+
+    def get_name(self, queryset, name, value):
+        return queryset.name_startswith(value)
 
     class Meta:
         model = Ingredient
@@ -18,23 +21,33 @@ class RecipeFilter(FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        method='get_tags'
     )
     is_favorited = filters.BooleanFilter(
         method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart')
+    search = filters.CharFilter(method='get_search')
+
+    def get_tags(self, queryset, name, value):
+        if value:
+            return queryset.with_tags(value)
+        return queryset
 
     def get_is_favorited(self, queryset, name, value):
         if value:
-            return (queryset.filter(favorite__user=self.request.user.id)
-                    .filter(favorite__user__isnull=False))
+            return queryset.favorited_by(self.request.user)
         return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value:
-            return (queryset.filter(shoppingcart__user=self.request.user.id)
-                    .filter(shoppingcart__user__isnull=False))
+            return queryset.in_cart_of(self.request.user)
+        return queryset
+
+    def get_search(self, queryset, name, value):
+        if value.strip():
+            return queryset.search(value)
         return queryset
 
     class Meta:
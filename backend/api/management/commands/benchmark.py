@@ -0,0 +1,280 @@
+import json
+import math
+import subprocess
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.db.models import Count
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.middleware import QueryTimer
+from foodgram.db.base import close_pools
+from foodgram.db.pool import pool_wait
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+PERCENTILES = (50, 95, 99)
+COMPARED = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request',
+            'throughput_rps')
+# database settings compared by --connections
+CONNECTION_MODES = {
+    'new': {'CONN_MAX_AGE': 0, 'POOL': {'SIZE': 0}},
+    'persistent': {'CONN_MAX_AGE': 60, 'POOL': {'SIZE': 0}},
+    'pooled': {'CONN_MAX_AGE': 0, 'POOL': {'SIZE': 2, 'TIMEOUT': 10}},
+}
+
+
+def percentile(values, rank):
+    """Nearest-rank percentile of sorted values"""
+    return values[max(math.ceil(rank / 100 * len(values)) - 1, 0)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', 'HEAD'), cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, число SQL-запросов и пропускную '
+            'способность ключевых эндпоинтов API, результат в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument('--user', type=int,
+                            help='id пользователя, от имени которого '
+                                 'выполняются запросы')
+        parser.add_argument('--scenario', action='append',
+                            help='Запустить только указанные сценарии')
+        parser.add_argument('--output', help='Файл для результата')
+        parser.add_argument('--baseline',
+                            help='Результат прошлого запуска для сравнения')
+        parser.add_argument('--connections', action='store_true',
+                            help='Сравнить новые, постоянные соединения '
+                                 'с базой и пул под параллельной нагрузкой')
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help='Потоков для --connections')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        scenarios = self.scenarios()
+        if options['scenario']:
+            unknown = set(options['scenario']) - set(scenarios)
+            if unknown:
+                raise CommandError(f'Неизвестные сценарии: {unknown}')
+            scenarios = {name: scenarios[name]
+                         for name in options['scenario']}
+        client = APIClient()
+        client.force_authenticate(user)
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for name, (path, params) in scenarios.items():
+                for _ in range(options['warmup']):
+                    self.request(client, path, params)
+                results[name] = self.run(client, path, params,
+                                         options['requests'])
+            if options['connections']:
+                connection_results = self.compare_connections(
+                    user, options['requests'], options['concurrency'])
+        report = {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(),
+                'commit': git_commit(),
+                'requests': options['requests'],
+                'user': user.pk,
+                'data': {
+                    'users': User.objects.count(),
+                    'recipes': Recipe.objects.count(),
+                    'ingredients': Ingredient.objects.count(),
+                },
+            },
+            'scenarios': results,
+        }
+        if options['connections']:
+            report['connections'] = connection_results
+        if options['baseline']:
+            self.compare(report, options['baseline'])
+        output = json.dumps(report, indent=2, ensure_ascii=False)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+    def get_user(self, pk):
+        """The given user or the one following the most authors"""
+        users = User.objects.all()
+        if pk is not None:
+            users = users.filter(pk=pk)
+        user = users.annotate(
+            subscriptions=Count('authors')
+        ).order_by('-subscriptions', 'pk').first()
+        if user is None:
+            raise CommandError('Нет пользователей, запустите seed_synthetic')
+        return user
+
+    def scenarios(self):
+        tags = list(Tag.objects.annotate(
+            used=Count('recipes')
+        ).order_by('-used').values_list('slug', flat=True)[:2])
+        ingredient = Ingredient.objects.annotate(
+            used=Count('recipeingredient')
+        ).order_by('-used').first()
+        prefix = ingredient.name[:2] if ingredient else 'а'
+        recipes = reverse('recipes-list')
+        return {
+            'recipes_list': (recipes, {'limit': 6}),
+            'recipes_deep_page': (recipes, {'limit': 6, 'page': 50}),
+            'recipes_cursor': (recipes, {'limit': 6, 'cursor': ''}),
+            'recipes_filtered': (recipes, {
+                'limit': 6, 'tags': tags, 'is_favorited': 1}),
+            'recipes_search': (recipes, {'limit': 6, 'search': prefix}),
+            'subscriptions': (reverse('users-subscriptions'), {
+                'limit': 6, 'recipes_limit': 3}),
+            'download_shopping_cart': (
+                reverse('recipes-download-shopping-cart'), {}),
+            'ingredients_name': (reverse('ingredients-list'),
+                                 {'name': prefix}),
+        }
+
+    def request(self, client, path, params):
+        response = client.get(path, params)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def run(self, client, path, params, requests):
+        latencies = []
+        statuses = Counter()
+        queries = QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            for _ in range(requests):
+                start = time.perf_counter()
+                response = self.request(client, path, params)
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[str(response.status_code)] += 1
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        result = {
+            f'p{rank}_ms': round(percentile(latencies, rank), 2)
+            for rank in PERCENTILES
+        }
+        result.update({
+            'mean_ms': round(sum(latencies) / requests, 2),
+            'queries_per_request': round(queries.count / requests, 2),
+            'db_ms_per_request': round(queries.db_time * 1000 / requests,
+                                       2),
+            'throughput_rps': round(requests / elapsed, 1),
+            'status_codes': dict(statuses),
+        })
+        return result
+
+    def compare(self, report, path):
+        """Relative change in percent against a previous report"""
+        with open(path) as file:
+            baseline = json.load(file)['scenarios']
+        for name, result in report['scenarios'].items():
+            previous = baseline.get(name)
+            if not previous:
+                continue
+            result['change_percent'] = {
+                metric: round((result[metric] - previous[metric])
+                              / previous[metric] * 100, 1)
+                for metric in COMPARED if previous.get(metric)
+            }
+
+    def compare_connections(self, user, requests, concurrency):
+        """Recipe list latency with each of CONNECTION_MODES
+
+        Requests go through the WSGI handler from several threads, so
+        connections are closed, kept or pooled between requests as they
+        are in production.
+        """
+        token = Token.objects.get_or_create(user=user)[0].key
+        request = RequestFactory().get(
+            reverse('recipes-list'), {'limit': 6},
+            HTTP_AUTHORIZATION=f'Token {token}')
+        handler = WSGIHandler()
+        results = {}
+        for mode, database in CONNECTION_MODES.items():
+            with mock.patch.dict(connection.settings_dict, database):
+                results[mode] = self.run_threads(
+                    handler, request.environ, requests, concurrency)
+            close_pools()
+        return results
+
+    def run_threads(self, handler, environ, requests, concurrency):
+        latencies = []
+        statuses = Counter()
+        opened = []
+        waits = []
+        lock = threading.Lock()
+
+        def count_connection(connection, **kwargs):
+            if not connection.reused:
+                opened.append(connection.alias)
+
+        def add_wait(wait, **kwargs):
+            waits.append(wait)
+
+        def worker(count):
+            for _ in range(count):
+                start = time.perf_counter()
+                response = handler(dict(environ), lambda *args: None)
+                b''.join(response)
+                response.close()
+                with lock:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    statuses[str(response.status_code)] += 1
+            connections.close_all()
+
+        connection_created.connect(count_connection)
+        pool_wait.connect(add_wait)
+        threads = [
+            threading.Thread(target=worker, args=(
+                requests // concurrency
+                + (index < requests % concurrency),))
+            for index in range(concurrency)
+        ]
+        started = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            connection_created.disconnect(count_connection)
+            pool_wait.disconnect(add_wait)
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        result = {
+            f'p{rank}_ms': round(percentile(latencies, rank), 2)
+            for rank in PERCENTILES
+        }
+        result.update({
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'connections_opened': len(opened),
+            'pool_wait_ms': round(sum(waits) * 1000, 2),
+            'status_codes': dict(statuses),
+        })
+        return result
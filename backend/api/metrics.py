@@ -0,0 +1,209 @@
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+
+from recipes.cache import ingredients_cache, recipes_cache, tags_cache
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    'foodgram_request_duration_seconds': (
+        'histogram', 'Время ответа API по маршрутам'),
+    'foodgram_token_auth_duration_seconds': (
+        'histogram', 'Время проверки токена'),
+    'foodgram_token_cache_requests_total': (
+        'counter', 'Обращения к кэшу токенов по результату'),
+    'foodgram_db_queries_total': (
+        'counter', 'SQL-запросы по маршрутам'),
+    'foodgram_db_query_duration_seconds_total': (
+        'counter', 'Время SQL-запросов по маршрутам'),
+    'foodgram_db_connections_opened_total': (
+        'counter', 'Открытые соединения с базой данных'),
+    'foodgram_db_connections_reused_total': (
+        'counter', 'Соединения с базой данных, взятые из пула'),
+    'foodgram_db_connections_open': (
+        'gauge', 'Соединения с базой данных, открытые сейчас'),
+    'foodgram_db_pool_wait_seconds': (
+        'histogram', 'Ожидание свободного соединения в пуле'),
+    'foodgram_db_pool_timeouts_total': (
+        'counter', 'Запросы соединения, не дождавшиеся места в пуле'),
+    'foodgram_cache_requests_total': (
+        'counter', 'Обращения к кэшу справочников по результату'),
+}
+
+REFERENCE_CACHES = (tags_cache, ingredients_cache, recipes_cache)
+
+
+def family(name):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            return name[:-len(suffix)]
+    return name
+
+
+def make_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+    """Metric values of this process, flushed to a file of its own
+
+    Every process writes its values to METRICS_DIR/<pid>.json at most
+    once per METRICS_FLUSH_INTERVAL seconds, and the exposition sums the
+    files of all processes, so the numbers hold across gunicorn workers.
+    A process that gets the pid of a dead one carries the counters of
+    its file on, so the totals never go backwards.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.values = defaultdict(float)
+        self.inherited = None
+        self.flushed = 0
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            self.values[make_key(name, labels)] += amount
+        self.maybe_flush()
+
+    def observe(self, name, value, **labels):
+        with self.lock:
+            for bound in (*LATENCY_BUCKETS, math.inf):
+                if value <= bound:
+                    le = '+Inf' if bound == math.inf else str(bound)
+                    self.values[make_key(f'{name}_bucket',
+                                         {**labels, 'le': le})] += 1
+            self.values[make_key(f'{name}_sum', labels)] += value
+            self.values[make_key(f'{name}_count', labels)] += 1
+        self.maybe_flush()
+
+    def collect(self):
+        with self.lock:
+            values = dict(self.values)
+        for cache in REFERENCE_CACHES:
+            for result, count in cache.stats.items():
+                values[make_key('foodgram_cache_requests_total', {
+                    'cache': cache.namespace, 'result': result
+                })] = count
+        values[make_key('foodgram_db_connections_open', {})] = sum(
+            conn.connection is not None for conn in connections.all())
+        return values
+
+    def flush(self, blocking=True):
+        """Write the values to the file of this process
+
+        Without blocking a flush already running in another thread is
+        left to finish instead.
+        """
+        if not self.flush_lock.acquire(blocking):
+            return
+        try:
+            path = os.path.join(settings.METRICS_DIR, f'{os.getpid()}.json')
+            if self.inherited is None:
+                self.inherited = {
+                    key: value for key, value in load_values(path)
+                    if METRICS.get(family(key[0]), ('',))[0] != 'gauge'
+                }
+            values = self.collect()
+            for key, value in self.inherited.items():
+                values[key] = values.get(key, 0) + value
+            with tempfile.NamedTemporaryFile(
+                    'w', dir=settings.METRICS_DIR, suffix='.tmp',
+                    delete=False) as file:
+                json.dump([[name, labels, value] for (name, labels), value
+                           in values.items()], file)
+            os.replace(file.name, path)
+            self.flushed = time.monotonic()
+        finally:
+            self.flush_lock.release()
+
+    def maybe_flush(self):
+        if (settings.METRICS_DIR and time.monotonic() - self.flushed
+                >= settings.METRICS_FLUSH_INTERVAL):
+            self.flush(blocking=False)
+
+
+registry = Registry()
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def load_values(path):
+    """(key, value) pairs of a flushed file, none if it is unreadable"""
+    try:
+        with open(path) as file:
+            values = json.load(file)
+    except (OSError, ValueError):
+        return []
+    return [((name, tuple(map(tuple, labels))), value)
+            for name, labels, value in values]
+
+
+def read_values():
+    """Values of all processes; gauges only from the live ones"""
+    registry.flush()
+    totals = defaultdict(float)
+    for file_name in os.listdir(settings.METRICS_DIR):
+        pid, extension = os.path.splitext(file_name)
+        if extension != '.json' or not pid.isdigit():
+            continue
+        alive = process_alive(int(pid))
+        for key, value in load_values(
+                os.path.join(settings.METRICS_DIR, file_name)):
+            kind, _ = METRICS.get(family(key[0]), ('untyped', None))
+            if kind == 'gauge' and not alive:
+                continue
+            totals[key] += value
+    return totals
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\')
+                         .replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in labels
+    )
+
+
+def sort_key(key):
+    name, labels = key
+    return name, tuple(
+        (label, float(value) if label == 'le' else value)
+        for label, value in labels
+    )
+
+
+def exposition():
+    """All metrics in the Prometheus text format"""
+    values = read_values()
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        keys = sorted((key for key in values if family(key[0]) == name),
+                      key=sort_key)
+        if not keys:
+            continue
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(f'{key[0]}{format_labels(key[1])} {values[key]!r}'
+                     for key in keys)
+    return '\n'.join(lines) + '\n'
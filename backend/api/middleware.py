@@ -0,0 +1,183 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_LIST = re.compile(r'\(%s(?:, %s)*\)')
+DUPLICATE_QUERY_MIN_COUNT = 2
+
+
+def fingerprint(sql):
+    """SQL without parameters; IN lists of any length look the same"""
+    return PLACEHOLDER_LIST.sub('(...)', sql)
+
+
+class QueryTimer:
+    """Execute wrapper counting queries and their time"""
+
+    def __init__(self):
+        self.db_time = 0
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.count += 1
+            self.record(sql)
+
+    def record(self, sql):
+        pass
+
+
+class RequestProfile(QueryTimer):
+    def __init__(self):
+        super().__init__()
+        self.start = time.perf_counter()
+        self.view_start = self.view_end = None
+        self.queries = Counter()
+
+    def record(self, sql):
+        self.queries[fingerprint(sql)] += 1
+
+    def timings(self, end):
+        """Durations in milliseconds"""
+        view_start = self.view_start or self.start
+        view_end = self.view_end or end
+        return {
+            'db': self.db_time * 1000,
+            'view': (view_end - view_start) * 1000,
+            'render': (end - view_end) * 1000,
+            'total': (end - self.start) * 1000,
+        }
+
+    def duplicates(self):
+        return [
+            {'sql': sql, 'count': count}
+            for sql, count in self.queries.most_common()
+            if count >= DUPLICATE_QUERY_MIN_COUNT
+        ]
+
+
+class ProfilingMiddleware:
+    """Sampled per-request SQL and serialization profile
+
+    Profiled responses get a Server-Timing header with the DB time and
+    query count, the view time (serialization included) and the render
+    time with the response size. Requests slower than SLOW_REQUEST_MS
+    are logged as JSON along with repeated query fingerprints, the usual
+    sign of an N+1.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_SAMPLE_RATE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.PROFILING_SAMPLE_RATE:
+            return self.get_response(request)
+        profile = request.profile = RequestProfile()
+        with connection.execute_wrapper(profile):
+            response = self.get_response(request)
+        self.report(request, response, profile)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if hasattr(request, 'profile'):
+            request.profile.view_start = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        if hasattr(request, 'profile'):
+            request.profile.view_end = time.perf_counter()
+        return response
+
+    def report(self, request, response, profile):
+        timings = profile.timings(time.perf_counter())
+        queries = profile.count
+        size = None if response.streaming else len(response.content)
+        descriptions = {'db': f'{queries} queries'}
+        if size is not None:
+            descriptions['render'] = f'{size} bytes'
+        response['Server-Timing'] = ', '.join(
+            f'{name};dur={duration:.1f}'
+            + (f';desc="{descriptions[name]}"' if name in descriptions
+               else '')
+            for name, duration in timings.items()
+        )
+        if timings['total'] < settings.SLOW_REQUEST_MS:
+            return
+        match = request.resolver_match
+        logger.warning(json.dumps({
+            'event': 'slow_request',
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'size': size,
+            'queries': queries,
+            'timings': {name: round(duration, 1)
+                        for name, duration in timings.items()},
+            'duplicate_queries': profile.duplicates(),
+        }, ensure_ascii=False))
+
+
+class MetricsMiddleware:
+    """Route latency and query counts for the /metrics endpoint
+
+    Under ASGI the async views query from worker threads, out of reach
+    of the execute wrapper, so only the latency is recorded there.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_DIR:
+            raise MiddlewareNotUsed
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # lets the handler recognize __call__ as a coroutine
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        queries = QueryTimer()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        route = self.observe(request, response, start)
+        registry.inc('foodgram_db_queries_total', queries.count, route=route)
+        registry.inc('foodgram_db_query_duration_seconds_total',
+                     queries.db_time, route=route)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.observe(request, response, start)
+        return response
+
+    def observe(self, request, response, start):
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        registry.observe('foodgram_request_duration_seconds',
+                         time.perf_counter() - start, route=route,
+                         method=request.method,
+                         status=str(response.status_code))
+        return route
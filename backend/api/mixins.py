@@ -0,0 +1,85 @@
+from functools import partial
+from hashlib import md5
+
+from django.http import HttpResponse
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class CachedListMixin:
+    """Serve JSON lists as pre-rendered bytes from a reference cache"""
+    reference_cache = None
+
+    def cached_response(self, request, render):
+        if request.accepted_renderer.format != 'json':
+            return render()
+        content = self.reference_cache.get_or_set(
+            request.get_full_path(),
+            lambda: self.render_content(request, render())
+        )
+        return HttpResponse(
+            content, content_type=request.accepted_renderer.media_type
+        )
+
+    def render_content(self, request, response):
+        return request.accepted_renderer.render(
+            response.data, request.accepted_media_type,
+            self.get_renderer_context()
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, partial(super().list, request, *args, **kwargs)
+        )
+
+
+class ConditionalGetMixin:
+    """ETags for list and detail views from a signal-bumped version
+
+    The tag is built from the version of version_cache, the user, the
+    full path and the media type, so a matching If-None-Match is
+    answered with 304 before serialization runs. Views narrow the
+    version to the scopes of get_etag_scopes, which may look the object
+    up and raise 404, so If-None-Match: * only matches what exists.
+    """
+    version_cache = None
+
+    def get_etag_scopes(self):
+        """Scopes of version_cache the response depends on, None is all"""
+        return None
+
+    def get_etag(self, request):
+        scopes = self.get_etag_scopes()
+        if scopes is None:
+            version = self.version_cache.version()
+        else:
+            version = [self.version_cache.version(scope) for scope in scopes]
+        key = (version, request.user.pk,
+               request.get_full_path(), request.accepted_media_type)
+        return '"%s"' % md5(repr(key).encode()).hexdigest()
+
+    def is_not_modified(self, request, etag):
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        return etag in if_none_match or '*' in if_none_match
+
+    def conditional_response(self, request, render):
+        etag = self.get_etag(request)
+        if self.is_not_modified(request, etag):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = render()
+        if response.status_code in (status.HTTP_200_OK,
+                                    status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, partial(super().list, request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, partial(super().retrieve, request, *args, **kwargs)
+        )
@@ -1,5 +1,133 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination as DefaultPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class PageNumberPagination(DefaultPagination):
     page_size_query_param = "limit"
+
+
+class FeedPagination(PageNumberPagination):
+    """Page numbers by default, keyset pagination when ?cursor= is given
+
+    Rows are ordered by the `ordering` fields, all descending, and the
+    cursor holds the key of the last (or first) row of the page, so
+    deep pages cost the same as the first one and no COUNT is run.
+    """
+    cursor_query_param = 'cursor'
+    ordering = ('creation_date', 'id')
+    invalid_cursor_message = 'Неверный курсор'
+    # ordering fields that hold dates, the others hold integer ids
+    date_fields = ('creation_date',)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        self.request = request
+        position, reverse = self.decode_cursor(request)
+        if reverse:
+            queryset = queryset.order_by(*self.ordering)
+        else:
+            queryset = queryset.order_by(*(f'-{f}' for f in self.ordering))
+        if position is not None:
+            queryset = queryset.filter(self.after(position, reverse))
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else position is not None
+        self.page = results
+        return results
+
+    def after(self, position, reverse):
+        """Rows strictly after position in the page direction"""
+        lookup = 'gt' if reverse else 'lt'
+        condition = Q()
+        for index in reversed(range(len(self.ordering))):
+            equal = {field: value for field, value in
+                     zip(self.ordering[:index], position)}
+            beyond = Q(**equal, **{
+                f'{self.ordering[index]}__{lookup}': position[index]
+            })
+            condition = beyond | condition if condition else beyond
+        edge = 'gte' if reverse else 'lte'
+        return Q(**{f'{self.ordering[0]}__{edge}': position[0]}) & condition
+
+    def decode_cursor(self, request):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            data = json.loads(urlsafe_b64decode(cursor.encode()))
+            position, reverse = data['p'], bool(data['r'])
+            if (not isinstance(position, list)
+                    or len(position) != len(self.ordering)):
+                raise ValueError
+            position = [self.parse_value(field, value) for field, value
+                        in zip(self.ordering, position)]
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def parse_value(self, field, value):
+        """Position value of a field as the queryset takes it"""
+        if field in self.date_fields:
+            if not isinstance(value, str):
+                raise ValueError
+            value = parse_datetime(value)
+            if value is None or value.tzinfo is None:
+                raise ValueError
+            return value
+        if (not isinstance(value, int) or isinstance(value, bool)
+                or not -2 ** 63 <= value < 2 ** 63):
+            raise ValueError
+        return value
+
+    def encode_cursor(self, obj, reverse):
+        position = []
+        for field in self.ordering:
+            value = getattr(obj, field)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            position.append(value)
+        data = json.dumps({'p': position, 'r': int(reverse)})
+        url = remove_query_param(self.request.build_absolute_uri(),
+                                 self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param,
+                                   urlsafe_b64encode(data.encode()).decode())
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', None),
+            ('next', self.encode_cursor(self.page[-1], False)
+             if self.has_next and self.page else None),
+            ('previous', self.encode_cursor(self.page[0], True)
+             if self.has_previous and self.page else None),
+            ('results', data),
+        ]))
+
+
+class SubscriptionsPagination(FeedPagination):
+    """Newest subscriptions first"""
+    ordering = ('subscription_id',)
+
+
+class PersonalFeedPagination(FeedPagination):
+    """Feed items, newest recipes first"""
+    ordering = ('creation_date', 'recipe_id')
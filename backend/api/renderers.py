@@ -0,0 +1,63 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class Echo:
+    """Pseudo-buffer for csv.writer: returns the line instead of storing"""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListTextRenderer(BaseRenderer):
+    """Shopping list as a plain text file"""
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = '\n'.join(f'{key}: {value}' for key, value in data.items())
+        return str(data).encode(self.charset)
+
+    def stream(self, rows):
+        yield 'Shopping list:\n'
+        for row in rows:
+            yield (f'{row["name"]}'
+                   f' - {row["amount"]}'
+                   f' {row["measurement_unit"]}\n')
+
+
+class ShoppingListCSVRenderer(ShoppingListTextRenderer):
+    """Shopping list as a CSV table"""
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        writer = csv.writer(Echo())
+        yield writer.writerow(('name', 'amount', 'measurement_unit'))
+        for row in rows:
+            yield writer.writerow(
+                (row['name'], row['amount'], row['measurement_unit'])
+            )
+
+
+class ShoppingListJSONRenderer(JSONRenderer):
+    """Shopping list as a JSON array, written one item at a time"""
+    charset = 'utf-8'
+
+    def stream(self, rows):
+        separator = '['
+        for row in rows:
+            yield separator + json.dumps(row, ensure_ascii=False)
+            separator = ','
+        yield '[]' if separator == '[' else ']'
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer,
+)
@@ -1,18 +1,28 @@
+from collections import defaultdict
+
 from django.contrib.auth import get_user_model
+from django.db import connection, transaction
 from djoser.serializers import (
     UserCreateSerializer as DjoserUserCreateSerializer,
     UserSerializer as DjoserUserSerializer
 )
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 from rest_framework.fields import SerializerMethodField
 from rest_framework.validators import UniqueTogetherValidator
 
+from api.fields import HeaderCheckedBase64ImageField, ThumbnailsField
+from recipes.cache import recipe_scope, recipes_cache, tags_cache
 from recipes.constants import (COOKING_TIME_MIN_VALUE, COOKING_TIME_MAX_VALUE,
                                AMOUNT_INGREDIENT_MIN_VALUE,
-                               AMOUNT_INGREDIENT_MAX_VALUE)
-from recipes.models import (Ingredient, Tag, RecipeIngredient, Recipe,
-                            Favorite, ShoppingCart)
+                               AMOUNT_INGREDIENT_MAX_VALUE,
+                               AUTOCOMPLETE_DEFAULT_LIMIT,
+                               AUTOCOMPLETE_MAX_LIMIT, BULK_MAX_ITEMS,
+                               ID_MAX_VALUE,
+                               SERVINGS_MIN_VALUE, SERVINGS_MAX_VALUE,
+                               WHAT_TO_COOK_MAX_INGREDIENTS)
+from recipes.models import (INDEXED_FIELDS, Ingredient, Tag,
+                            RecipeIngredient, Recipe)
+from recipes.shopping_list import change_ingredients
 from users.models import Subscribe
 
 User = get_user_model()
@@ -34,6 +44,8 @@ class UserSerializer(DjoserUserSerializer):
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
+        if hasattr(obj, 'is_subscribed'):
+            return request.user.is_authenticated and obj.is_subscribed
         return (request.user.is_authenticated
                 and Subscribe.objects.filter(
                     user=request.user, author=obj
@@ -58,6 +70,42 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class AutocompleteSerializer(serializers.Serializer):
+    name = serializers.CharField(required=True)
+    limit = serializers.IntegerField(
+        default=AUTOCOMPLETE_DEFAULT_LIMIT,
+        min_value=1,
+        max_value=AUTOCOMPLETE_MAX_LIMIT,
+    )
+
+
+class WhatToCookSerializer(serializers.Serializer):
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=ID_MAX_VALUE),
+        allow_empty=False,
+        max_length=WHAT_TO_COOK_MAX_INGREDIENTS,
+    )
+
+
+class ShoppingListSerializer(serializers.Serializer):
+    servings = serializers.IntegerField(
+        min_value=SERVINGS_MIN_VALUE,
+        max_value=SERVINGS_MAX_VALUE,
+        default=SERVINGS_MIN_VALUE,
+    )
+
+
+class BulkSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=ID_MAX_VALUE),
+        allow_empty=False,
+        max_length=BULK_MAX_ITEMS,
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
+
+
 class RecipeIngredientSerializer(serializers.ModelSerializer):
     name = serializers.StringRelatedField(
         source='ingredient.name'
@@ -81,29 +129,45 @@ class TagSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+def get_tags_by_id(refresh=False):
+    """Serialized tags by id, in Tag ordering, from the tags cache"""
+    def load():
+        return {tag['id']: dict(tag)
+                for tag in TagSerializer(Tag.objects.all(), many=True).data}
+
+    if refresh:
+        tags = load()
+        tags_cache.set('by_id', tags)
+        return tags
+    return tags_cache.get_or_set('by_id', load)
+
+
 class RecipeListSerializer(serializers.ModelSerializer):
     is_favorited = SerializerMethodField(read_only=True)
     is_in_shopping_cart = SerializerMethodField(read_only=True)
-    tags = TagSerializer(many=True, read_only=True)
+    tags = SerializerMethodField()
     author = UserSerializer(read_only=True)
     ingredients = SerializerMethodField()
-    image = Base64ImageField()
+    image = HeaderCheckedBase64ImageField()
+    thumbnails = ThumbnailsField()
+
+    def get_tags(self, obj):
+        tag_ids = set(obj.tag_ids or ())
+        tags = get_tags_by_id()
+        if not tag_ids.issubset(tags):
+            tags = get_tags_by_id(refresh=True)
+        return [tag for pk, tag in tags.items() if pk in tag_ids]
 
     def get_ingredients(self, obj):
-        qs = RecipeIngredient.objects.filter(recipe=obj).all()
-        return RecipeIngredientSerializer(qs, many=True).data
+        return RecipeIngredientSerializer(
+            obj.recipeingredient_set.all(), many=True
+        ).data
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.favorite.filter(recipe=obj).exists()
+        return obj.is_favorited
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        if user.is_anonymous:
-            return False
-        return user.shoppingcart.filter(recipe=obj).exists()
+        return obj.is_in_shopping_cart
 
     class Meta:
         model = Recipe
@@ -114,13 +178,33 @@ class RecipeListSerializer(serializers.ModelSerializer):
             'ingredients',
             'is_favorited',
             'is_in_shopping_cart',
+            'favorites_count',
             'name',
             'image',
+            'thumbnails',
             'text',
             'cooking_time',
         )
 
 
+class CookableRecipeSerializer(RecipeListSerializer):
+    """Recipe with its coverage by the ingredients from context"""
+    coverage = serializers.FloatField(read_only=True)
+    missing_ingredients = SerializerMethodField()
+
+    def get_missing_ingredients(self, obj):
+        available = self.context['available_ingredients']
+        return RecipeIngredientSerializer(
+            [row for row in obj.recipeingredient_set.all()
+             if row.ingredient_id not in available], many=True
+        ).data
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + (
+            'coverage', 'missing_ingredients'
+        )
+
+
 class IngredientCreateInRecipeSerializer(serializers.ModelSerializer):
     recipe = serializers.PrimaryKeyRelatedField(read_only=True)
     id = serializers.PrimaryKeyRelatedField(
@@ -142,7 +226,7 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
     ingredients = IngredientCreateInRecipeSerializer(many=True)
     tags = serializers.PrimaryKeyRelatedField(queryset=Tag.objects.all(),
                                               many=True)
-    image = Base64ImageField(required=False)
+    image = HeaderCheckedBase64ImageField(required=False)
     cooking_time = serializers.IntegerField(
         write_only=True,
         min_value=COOKING_TIME_MIN_VALUE,
@@ -161,30 +245,98 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         RecipeIngredient.objects.bulk_create(
             create_ingredients
         )
+        Recipe.objects.filter(pk=recipe.pk).update_indexes()
+        recipes_cache.bump(recipe_scope(recipe.pk))
 
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(**validated_data)
+        recipe = Recipe(**validated_data)
+        # the indexes are refreshed once the ingredients are in place
+        recipe.defer_indexes = True
+        recipe.save()
         recipe.tags.set(tags)
         self.create_ingredients(recipe=recipe, ingredients=ingredients)
         return recipe
 
+    def update_ingredients(self, ingredients, recipe):
+        """Apply only the rows that differ from the stored ingredients
+
+        Returns whether any row changed.
+        """
+        amounts = {ingredient['ingredient'].id: ingredient['amount']
+                   for ingredient in ingredients}
+        current = {row.ingredient_id: row for row in
+                   RecipeIngredient.objects.filter(recipe=recipe)}
+        previous = {ingredient_id: row.amount
+                    for ingredient_id, row in current.items()}
+        removed = [row for ingredient_id, row in current.items()
+                   if ingredient_id not in amounts]
+        changed = []
+        for ingredient_id, row in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        added = [
+            RecipeIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in current
+        ]
+        if removed:
+            # nothing refers to these rows, so they are deleted in one
+            # statement without the per-row signals; the shopping lists
+            # and the indexes are updated once below
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'DELETE FROM recipes_recipeingredient WHERE id = ANY(%s)',
+                    [[row.id for row in removed]]
+                )
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        if added:
+            RecipeIngredient.objects.bulk_create(added)
+        change_ingredients(recipe.pk, {
+            **{row.ingredient_id: -row.amount for row in removed},
+            **{row.ingredient_id: row.amount - previous[row.ingredient_id]
+               for row in changed},
+            **{row.ingredient_id: row.amount for row in added},
+        })
+        if removed or changed or added:
+            recipes_cache.bump(recipe_scope(recipe.pk))
+            return True
+        return False
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
-        instance = super().update(instance, validated_data)
-        instance.tags.clear()
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.create_ingredients(recipe=instance, ingredients=ingredients)
-        instance.save()
+        """Save only the edited fields and refresh the indexes once
+
+        A full save would write back the counters, thumbnails and indexes
+        the instance was read with.
+        """
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('ingredients', None)
+        for field, value in validated_data.items():
+            setattr(instance, field, value)
+        if validated_data:
+            instance.defer_indexes = True
+            instance.save(update_fields=list(validated_data))
+        if tags is not None:
+            instance.tags.set(tags)
+        refresh = bool(INDEXED_FIELDS & set(validated_data))
+        if ingredients is not None:
+            refresh |= self.update_ingredients(recipe=instance,
+                                               ingredients=ingredients)
+        if refresh:
+            Recipe.objects.filter(pk=instance.pk).update_indexes()
         return instance
 
     def to_representation(self, obj):
         request = self.context.get('request')
         context = {'request': request}
-        return RecipeListSerializer(obj, context=context).data
+        recipe = Recipe.objects.for_list(request.user).get(pk=obj.pk)
+        return RecipeListSerializer(recipe, context=context).data
 
     class Meta:
         model = Recipe
@@ -199,7 +351,8 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
 
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
-    image = Base64ImageField()
+    image = HeaderCheckedBase64ImageField()
+    thumbnails = ThumbnailsField()
 
     class Meta:
         model = Recipe
@@ -207,33 +360,57 @@ class ShortRecipeSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'thumbnails',
             'cooking_time'
         )
 
 
+class SubscriptionsListSerializer(serializers.ListSerializer):
+    """Loads the recipes of every author on the page in one query"""
+
+    def to_representation(self, data):
+        authors = list(data.all() if hasattr(data, 'all') else data)
+        recipes = defaultdict(list)
+        for recipe in Recipe.objects.latest_by_author(
+                authors, self.child.get_recipes_limit()):
+            recipes[recipe.author_id].append(recipe)
+        for author in authors:
+            author.latest_recipes = recipes[author.pk]
+        return super().to_representation(authors)
+
+
 class SubscriptionsSerializer(UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
 
-    def get_recipes(self, obj):
+    def get_recipes_limit(self):
         request = self.context.get('request')
-        recipes_limit = None
-        if request:
-            recipes_limit = request.data.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if recipes_limit:
-            recipes = obj.recipes.all()[:int(recipes_limit)]
+        if not request:
+            return None
+        recipes_limit = request.query_params.get(
+            'recipes_limit', request.data.get('recipes_limit'))
+        if recipes_limit in (None, ''):
+            return None
+        return serializers.IntegerField(min_value=0).run_validation(
+            recipes_limit)
+
+    def get_recipes(self, obj):
+        recipes = getattr(obj, 'latest_recipes', None)
+        if recipes is None:
+            recipes = Recipe.objects.latest_by_author(
+                [obj], self.get_recipes_limit())
         return ShortRecipeSerializer(recipes, many=True,
-                                     context={'request': request}).data
+                                     context=self.context).data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     class Meta:
         model = User
         fields = ('email', 'id', 'username', 'first_name',
                   'last_name', 'is_subscribed', 'recipes', 'recipes_count')
+        list_serializer_class = SubscriptionsListSerializer
         read_only_fields = ('email', 'username', 'first_name', 'last_name',
                             'is_subscribed', 'recipes', 'recipes_count')
 
@@ -263,53 +440,3 @@ class SubscribeSerializer(serializers.ModelSerializer):
                 message='Вы уже подписаны на этого пользователя'
             )
         ]
-
-
-class FavoriteSerializer(serializers.ModelSerializer):
-
-    def validate(self, data):
-        request = self.context.get('request')
-        if request.method == 'POST' and Favorite.objects.filter(
-                user=data['user'],
-                recipe=data['recipe']
-        ).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже в избранном'
-            )
-        elif request.method == 'DELETE' and not Favorite.objects.filter(
-                user=data['user'],
-                recipe=data['recipe']
-        ).exists():
-            raise serializers.ValidationError(
-                'Рецепт отсутствует в избранном'
-            )
-        return data
-
-    class Meta:
-        model = Favorite
-        fields = ('user', 'recipe')
-
-
-class ShoppingCartSerializer(serializers.ModelSerializer):
-
-    def validate(self, data):
-        request = self.context.get('request')
-        if request.method == 'POST' and ShoppingCart.objects.filter(
-                user=data['user'],
-                recipe=data['recipe']
-        ).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже в корзине'
-            )
-        elif request.method == 'DELETE' and not ShoppingCart.objects.filter(
-                user=data['user'],
-                recipe=data['recipe']
-        ).exists():
-            raise serializers.ValidationError(
-                'Рецепт отсутствует в корзине'
-            )
-        return data
-
-    class Meta:
-        model = ShoppingCart
-        fields = ('user', 'recipe')
@@ -0,0 +1,61 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from foodgram.db.pool import pool_timeout, pool_wait
+
+from .authentication import token_cache
+from .metrics import registry
+
+User = get_user_model()
+
+
+@receiver(connection_created)
+def count_connection(connection, **kwargs):
+    if getattr(connection, 'reused', False):
+        registry.inc('foodgram_db_connections_reused_total',
+                     alias=connection.alias)
+    else:
+        registry.inc('foodgram_db_connections_opened_total',
+                     alias=connection.alias)
+
+
+@receiver(pool_wait)
+def observe_pool_wait(alias, wait, **kwargs):
+    registry.observe('foodgram_db_pool_wait_seconds', wait, alias=alias)
+
+
+@receiver(pool_timeout)
+def count_pool_timeout(alias, **kwargs):
+    registry.inc('foodgram_db_pool_timeouts_total', alias=alias)
+
+
+def revoke(keys):
+    """Invalidate now and once more when the transaction commits
+
+    Until the commit other requests still see the token and the user
+    as they were and may cache them under the first new generation.
+    """
+    keys = list(keys)
+    for key in keys:
+        token_cache.invalidate(key)
+    transaction.on_commit(lambda: [token_cache.invalidate(key)
+                                   for key in keys])
+
+
+@receiver(post_delete, sender=Token)
+def revoke_cached_token(instance, **kwargs):
+    revoke([instance.key])
+
+
+@receiver(post_save, sender=User)
+def revoke_cached_user(instance, created, update_fields=None, **kwargs):
+    """Password change, deactivation or any other change of the user"""
+    if created or (update_fields is not None
+                   and set(update_fields) == {'last_login'}):
+        return
+    revoke(Token.objects.filter(user=instance).values_list(
+        'key', flat=True))
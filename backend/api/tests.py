@@ -1,12 +1,41 @@
+import asyncio
+import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync
 from django.contrib.auth import get_user_model
-from django.urls import reverse
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.urls import resolve, reverse
+from django.test import (AsyncClient, RequestFactory, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.authtoken.models import Token
+from PIL import Image
 from rest_framework.test import APIClient
 
-from recipes.models import (Ingredient, Tag, RecipeIngredient, Recipe,
-                            Favorite, ShoppingCart)
+from api.authentication import token_cache
+from api.filters import RecipeFilter
+from api.metrics import read_values, registry
+from api.serializers import RecipeCreateSerializer
+from foodgram.db.base import (HEALTH_CHECK_IDLE_SECONDS, DatabaseWrapper,
+                              close_pools)
+from recipes.cache import recipes_cache, tags_cache
+from recipes.constants import BULK_MAX_ITEMS, SERVINGS_MAX_VALUE
+from recipes.counters import reconcile_counters
+from recipes.models import (FeedItem, Ingredient, MeasurementUnit, Tag,
+                            RecipeIngredient, Recipe, Favorite, ShoppingCart,
+                            ShoppingListItem)
+from recipes.shopping_list import rebuild_shopping_lists
+from recipes.user_recipes import add_recipe
 from users.models import Subscribe
 
 User = get_user_model()
@@ -184,8 +213,35 @@ class IngredientTestCase(TestCase):
 
         resp = self.client_auth.get(url, data=params)
 
-        self.assertEqual(len(resp.data), 1)
-        self.assertEqual(resp.data[0]['name'], self.sugar.name)
+        self.assertEqual(len(resp.json()), 1)
+        self.assertEqual(resp.json()[0]['name'], self.sugar.name)
+
+        resp = self.client_auth.get(url, data={'name': 'sug'})
+        self.assertEqual([item['name'] for item in resp.json()],
+                         [self.sugar.name])
+
+    def test_autocomplete(self):
+        url = reverse('ingredients-autocomplete')
+        Ingredient.objects.create(name='ванильный сахар',
+                                  measurement_unit='г')
+        Ingredient.objects.create(name='сахарная пудра',
+                                  measurement_unit='г')
+        Ingredient.objects.create(name='сахар', measurement_unit='г')
+
+        resp = self.client_non_auth.get(url, data={'name': 'Сах'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['name'] for item in resp.json()],
+                         ['сахар', 'сахарная пудра', 'ванильный сахар'])
+
+        resp = self.client_non_auth.get(url, data={'name': 'сах',
+                                                   'limit': 1})
+        self.assertEqual([item['name'] for item in resp.json()], ['сахар'])
+
+        resp = self.client_non_auth.get(url, data={'name': 'ах'})
+        self.assertEqual(resp.json(), [])
+
+        resp = self.client_non_auth.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
 
     def test_get_ingredient_detail(self):
         url = reverse('ingredients-detail', args=(self.salt.pk,))
@@ -196,6 +252,37 @@ class IngredientTestCase(TestCase):
         self.assertEqual(self.salt.id, resp.data.get('id'))
 
 
+class LoadIngredientsTestCase(TestCase):
+
+    def load(self, content, suffix, *args):
+        with tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False,
+                                         encoding='utf-8') as file:
+            file.write(content)
+        self.addCleanup(os.remove, file.name)
+        call_command('load_ingredients', file.name, *args, stdout=StringIO())
+
+    def assert_loaded(self, *args):
+        self.load('соль,г\n"молоко 2,5%",мл\n,г\n', '.csv', *args)
+        self.load(json.dumps([
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'сахар', 'measurement_unit': 'г'},
+        ]), '.json', *args)
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', 'measurement_unit',
+                                               'unit__name')),
+            {('соль', 'г', 'г'), ('молоко 2,5%', 'мл', 'мл'),
+             ('сахар', 'г', 'г')}
+        )
+
+    def test_load_with_copy(self):
+        self.assert_loaded()
+        self.assert_loaded()
+
+    def test_load_with_bulk_create(self):
+        self.assert_loaded('--no-copy', '--batch-size', '1')
+        self.assert_loaded('--no-copy', '--batch-size', '1')
+
+
 class TagTestCase(TestCase):
 
     @classmethod
@@ -223,6 +310,33 @@ class TagTestCase(TestCase):
         resp = self.client_auth.get(url)
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
 
+    def test_tag_list_cache(self):
+        url = reverse('tags-list')
+        self.client_non_auth.get(url)
+        with self.assertNumQueries(0):
+            resp = self.client_non_auth.get(url)
+        self.assertEqual([tag['slug'] for tag in resp.json()],
+                         ['breakfast'])
+
+        Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+        resp = self.client_non_auth.get(url)
+        self.assertEqual([tag['slug'] for tag in resp.json()],
+                         ['breakfast', 'lunch'])
+
+        self.tag.delete()
+        resp = self.client_non_auth.get(url)
+        self.assertEqual([tag['slug'] for tag in resp.json()], ['lunch'])
+
+    def test_tag_version_bumped_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            Tag.objects.create(name='Обед', color='#49B64E', slug='lunch')
+            # a request reading the old rows before the commit caches
+            # them under this version
+            version = tags_cache.version()
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(tags_cache.version(), version)
+
     def test_get_tag_detail(self):
         url = reverse('tags-detail', args=(self.tag.pk,))
 
@@ -327,6 +441,322 @@ class RecipeTestCase(TestCase):
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
         self.assertEqual(resp.data.get('name'), data['name'])
 
+    def test_update_recipe_applies_diff(self):
+        url = reverse('recipes-detail', args=(self.recipe.pk,))
+        sugar = Ingredient.objects.create(name='Sugar', measurement_unit='g')
+        pepper = Ingredient.objects.create(name='Pepper',
+                                           measurement_unit='g')
+        RecipeIngredient.objects.create(recipe=self.recipe, ingredient=sugar,
+                                        amount=5)
+        data = {
+            "name": "soup",
+            "text": "some_text",
+            "ingredients": [{'id': self.salt.id, 'amount': 21},
+                            {'id': pepper.id, 'amount': 1}],
+            "tags": [self.tag_white.pk],
+            "cooking_time": 1,
+        }
+        resp = self.client_auth.patch(url, data=data)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        # changed amount is updated in place, the row keeps its id
+        self.ingredient_recipe.refresh_from_db()
+        self.assertEqual(self.ingredient_recipe.amount, 21)
+        self.assertEqual(
+            dict(RecipeIngredient.objects.filter(
+                recipe=self.recipe).values_list('ingredient', 'amount')),
+            {self.salt.id: 21, pepper.id: 1}
+        )
+        self.assertEqual(list(self.recipe.tags.all()), [self.tag_white])
+
+        resp = self.client_auth.patch(url, data={'name': 'Только имя'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.data['ingredients']), 2)
+
+
+class RecipeListQueriesTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.client_auth = APIClient()
+        self.user = User.objects.create_user(username='user',
+                                             email='user@email.ru')
+        self.client_auth.force_authenticate(user=self.user)
+        self.author = User.objects.create_user(username='author',
+                                               email='author@email.ru')
+        Subscribe.objects.create(user=self.user, author=self.author)
+
+        salt = Ingredient.objects.create(name='Salt', measurement_unit='kg')
+        sugar = Ingredient.objects.create(name='Sugar', measurement_unit='g')
+        tag_black = Tag.objects.create(name='black', slug='black')
+        tag_white = Tag.objects.create(name='white', slug='white')
+        for i in range(10):
+            recipe = Recipe.objects.create(
+                name=f'soup{i}',
+                author=self.author if i % 2 else self.user,
+                text='some_text',
+                cooking_time=1
+            )
+            recipe.tags.add(tag_black, tag_white)
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=salt,
+                                            amount=10)
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=sugar,
+                                            amount=20)
+            if i % 3 == 0:
+                Favorite.objects.create(user=self.user, recipe=recipe)
+                ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def count_list_queries(self, client, limit):
+        url = reverse('recipes-list')
+        with CaptureQueriesContext(connection) as queries:
+            resp = client.get(url, data={'page': 1, 'limit': limit})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(resp.data['results']), limit)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        self.count_list_queries(self.client_auth, 1)
+        self.assertEqual(self.count_list_queries(self.client_auth, 1),
+                         self.count_list_queries(self.client_auth, 10))
+        self.assertEqual(self.count_list_queries(APIClient(), 1),
+                         self.count_list_queries(APIClient(), 10))
+
+    def test_user_flags(self):
+        resp = self.client_auth.get(reverse('recipes-list'))
+        for item in resp.data:
+            recipe = Recipe.objects.get(pk=item['id'])
+            self.assertEqual(
+                item['is_favorited'],
+                Favorite.objects.filter(user=self.user,
+                                        recipe=recipe).exists())
+            self.assertEqual(
+                item['is_in_shopping_cart'],
+                ShoppingCart.objects.filter(user=self.user,
+                                            recipe=recipe).exists())
+            self.assertEqual(item['author']['is_subscribed'],
+                             recipe.author == self.author)
+            self.assertEqual(len(item['ingredients']), 2)
+            self.assertEqual(len(item['tags']), 2)
+
+
+class KeysetPaginationTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.client_auth = APIClient()
+        self.user = User.objects.create_user(username='user',
+                                             email='user@email.ru')
+        self.client_auth.force_authenticate(user=self.user)
+        for i in range(5):
+            author = User.objects.create_user(username=f'author{i}',
+                                              email=f'author{i}@email.ru')
+            Subscribe.objects.create(user=self.user, author=author)
+            Recipe.objects.create(
+                name=f'soup{i}',
+                author=author,
+                text='some_text',
+                cooking_time=1
+            )
+
+    def walk(self, url, key):
+        seen = []
+        data = {'cursor': '', 'limit': 2}
+        while url:
+            resp = self.client_auth.get(url, data=data)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertIsNone(resp.data['count'])
+            seen += [item[key] for item in resp.data['results']]
+            last, url, data = resp.data, resp.data['next'], None
+        return seen, last
+
+    def test_recipes_cursor(self):
+        url = reverse('recipes-list')
+        expected = list(Recipe.objects.order_by(
+            '-creation_date', '-id').values_list('id', flat=True))
+        seen, last = self.walk(url, 'id')
+        self.assertEqual(seen, expected)
+
+        resp = self.client_auth.get(last['previous'])
+        self.assertEqual([item['id'] for item in resp.data['results']],
+                         expected[2:4])
+        self.assertIsNotNone(resp.data['previous'])
+        self.assertIsNotNone(resp.data['next'])
+
+        resp = self.client_auth.get(url, data={'cursor': 'garbage',
+                                               'limit': 2})
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+        resp = self.client_auth.get(url, data={'page': 1, 'limit': 2})
+        self.assertEqual(resp.data['count'], 5)
+
+    def test_tampered_cursor(self):
+        url = reverse('recipes-list')
+        for position in (['garbage', 1], [None, 1], ['2024-01-01', 1],
+                         ['2024-13-01T00:00:00+00:00', 1],
+                         ['2024-01-01T00:00:00+00:00', '1'],
+                         ['2024-01-01T00:00:00+00:00', 2 ** 63],
+                         ['2024-01-01T00:00:00+00:00', True],
+                         ['2024-01-01T00:00:00+00:00'], 'p', None):
+            with self.subTest(position=position):
+                cursor = base64.urlsafe_b64encode(json.dumps(
+                    {'p': position, 'r': 0}).encode()).decode()
+                resp = self.client_auth.get(url, data={'cursor': cursor,
+                                                       'limit': 2})
+                self.assertEqual(resp.status_code,
+                                 status.HTTP_404_NOT_FOUND)
+
+    def test_subscriptions_cursor(self):
+        expected = list(Subscribe.objects.filter(
+            user=self.user).values_list('author__username', flat=True))
+        seen, _ = self.walk(reverse('users-subscriptions'), 'username')
+        self.assertEqual(seen, expected)
+
+
+class RecipeFilterPlanTestCase(TestCase):
+    """Recipe list filters must be served by indexes, not Seq Scans"""
+    RECIPES = 3000
+    USERS = 20
+    TAGS = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create(
+            User(username=f'user{i}', email=f'user{i}@email.ru')
+            for i in range(cls.USERS)
+        )
+        cls.user = users[0]
+        cls.tags = Tag.objects.bulk_create(
+            Tag(name=f'tag{i}', slug=f'tag{i}') for i in range(cls.TAGS)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(name=f'soup{i}', author=users[i % cls.USERS],
+                   text='some_text', cooking_time=1)
+            for i in range(cls.RECIPES)
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=cls.tags[i % cls.TAGS])
+            for i, recipe in enumerate(recipes)
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe,
+                                tag=cls.tags[(i + 1) % cls.TAGS])
+            for i, recipe in enumerate(recipes)
+        )
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                model(user=user, recipe=recipe)
+                for user in users
+                for recipe in recipes[users.index(user)::cls.USERS * 3]
+            )
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def filtered(self, **data):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        return RecipeFilter(
+            data=data, request=request,
+            queryset=Recipe.objects.for_list(self.user)
+        ).qs
+
+    def assert_plan(self, queryset, index, disabled=()):
+        """No Seq Scan, and the plan uses the index
+
+        The disabled planner methods are switched off for the query.
+        """
+        with connection.cursor() as cursor:
+            for method in ('enable_seqscan', *disabled):
+                cursor.execute(f'SET LOCAL {method} = off')
+        plan = queryset[:10].explain()
+        with connection.cursor() as cursor:
+            for method in disabled:
+                cursor.execute(f'RESET {method}')
+        self.assertNotIn('Seq Scan', plan)
+        self.assertIn(index, plan)
+        self.assertNotIn('DISTINCT', str(queryset.query))
+
+    def test_plans(self):
+        cases = (
+            ({}, 'recipe_creation_date_id_idx'),
+            ({'author': self.user.id}, 'recipe_author_creation_idx'),
+            ({'tags': ['tag1', 'tag2']}, 'recipe_creation_date_id_idx'),
+            ({'is_favorited': 1}, 'recipes_favorite_user_id'),
+            ({'is_in_shopping_cart': 1}, 'recipes_shoppingcart_user_id'),
+        )
+        for data, index in cases:
+            with self.subTest(**data):
+                self.assert_plan(self.filtered(**data), index)
+
+    def test_combined_filters_plan(self):
+        # hashing the tag rows against the favorites costs about as
+        # much as the author index, and which one wins depends on how
+        # much the recipes table has grown in the earlier tests
+        self.assert_plan(
+            self.filtered(tags=['tag1'], is_favorited=1, author=self.user.id),
+            'recipe_author_creation_idx', disabled=('enable_hashjoin',))
+
+    def test_search_plan(self):
+        Recipe.objects.update_indexes()
+        self.assert_plan(self.filtered(search='soup1'),
+                         'recipe_search_vector_idx')
+
+    def test_tags_filter_has_no_duplicates(self):
+        ids = list(self.filtered(tags=['tag1', 'tag2']).values_list(
+            'id', flat=True))
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(len(ids), self.RECIPES * 3 // self.TAGS)
+
+
+class RecipeImageTestCase(TestCase):
+
+    def setUp(self) -> None:
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root, IMAGE_WORKERS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.client_auth = APIClient()
+        self.user = User.objects.create_user(username='user')
+        self.client_auth.force_authenticate(user=self.user)
+        self.salt = Ingredient.objects.create(name='Salt',
+                                              measurement_unit='kg')
+        self.tag = Tag.objects.create(name='black', slug='black')
+        output = BytesIO()
+        Image.new('RGB', (1000, 500), 'red').save(output, 'PNG')
+        self.image = ('data:image/png;base64,'
+                      + base64.b64encode(output.getvalue()).decode())
+
+    def create_recipe(self, image):
+        data = {
+            "name": "Медовуха",
+            "text": "Сварить",
+            "ingredients": [{'id': self.salt.id, 'amount': '10'}, ],
+            "tags": [self.tag.pk, ],
+            "cooking_time": 1,
+            "image": image,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client_auth.post(reverse('recipes-list'), data=data)
+
+    def test_thumbnails_and_deduplication(self):
+        first = self.create_recipe(self.image)
+        second = self.create_recipe(self.image)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(first.data['image'], second.data['image'])
+
+        recipe = Recipe.objects.get(pk=first.data['id'])
+        self.assertEqual(recipe.thumbnails['source'], recipe.image.name)
+        resp = self.client_auth.get(
+            reverse('recipes-detail', args=(recipe.pk,)))
+        self.assertEqual(set(resp.data['thumbnails']), {'320', '640'})
+        self.assertEqual(set(resp.data['thumbnails']['320']),
+                         {'webp', 'jpg'})
+        with recipe.image.storage.open(
+                recipe.thumbnails['sizes']['320']['webp']) as file:
+            self.assertEqual(Image.open(file).size, (320, 160))
+
+    def test_invalid_image(self):
+        resp = self.create_recipe('data:image/png;base64,bm90IGFuIGltYWdl')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class FavoriteTestCase(TestCase):
 
@@ -405,6 +835,261 @@ class FavoriteTestCase(TestCase):
         self.assertEqual(len(Favorite.objects.all()), 0)
 
 
+class CountersTestCase(TestCase):
+
+    def setUp(self) -> None:
+        self.client_auth = APIClient()
+        self.user = User.objects.create_user(username='user',
+                                             email='user@email.ru')
+        self.client_auth.force_authenticate(user=self.user)
+        self.recipe = Recipe.objects.create(
+            name='soup',
+            author=self.user,
+            text='some_text',
+            cooking_time=1
+        )
+        self.recipe2 = Recipe.objects.create(
+            name='soup2',
+            author=self.user,
+            text='some_text',
+            cooking_time=1
+        )
+
+    def assert_counters(self, favorites, in_carts, recipes):
+        self.recipe.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, favorites)
+        self.assertEqual(self.recipe.in_carts_count, in_carts)
+        self.assertEqual(self.user.recipes_count, recipes)
+
+    def test_recipe_update_keeps_counters(self):
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        serializer = RecipeCreateSerializer(
+            stale, data={'name': 'borscht'}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assert_counters(favorites=1, in_carts=0, recipes=2)
+        self.assertEqual(self.recipe.name, 'borscht')
+
+    def test_counters_follow_writes(self):
+        self.assert_counters(0, 0, 2)
+        self.client_auth.post(
+            reverse('recipes-favorite', args=(self.recipe.pk,)))
+        self.client_auth.post(
+            reverse('recipes-shopping-cart', args=(self.recipe.pk,)))
+        self.assert_counters(1, 1, 2)
+
+        resp = self.client_auth.get(reverse('recipes-list'),
+                                    data={'ordering': '-favorites_count'})
+        self.assertEqual(resp.data[0]['id'], self.recipe.id)
+        self.assertEqual(resp.data[0]['favorites_count'], 1)
+
+        self.client_auth.delete(
+            reverse('recipes-favorite', args=(self.recipe.pk,)))
+        self.client_auth.delete(
+            reverse('recipes-shopping-cart', args=(self.recipe.pk,)))
+        self.recipe2.delete()
+        self.assert_counters(0, 0, 1)
+
+    def test_counters_follow_reassignment(self):
+        other = User.objects.create_user(username='other',
+                                         email='other@email.ru')
+        favorite = Favorite.objects.create(user=self.user,
+                                           recipe=self.recipe2)
+        cart = ShoppingCart.objects.create(user=self.user,
+                                           recipe=self.recipe2)
+        favorite.recipe = cart.recipe = self.recipe
+        favorite.save()
+        cart.save()
+        self.recipe2.author = other
+        self.recipe2.save()
+        self.assert_counters(1, 1, 1)
+        self.recipe2.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.recipe2.favorites_count,
+                          self.recipe2.in_carts_count), (0, 0))
+        self.assertEqual(other.recipes_count, 1)
+        self.assertEqual(reconcile_counters(), {
+            'favorites_count': 0, 'in_carts_count': 0, 'recipes_count': 0})
+
+    def test_reconcile_counters(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        Recipe.objects.update(favorites_count=5, in_carts_count=3)
+        User.objects.update(recipes_count=0)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assert_counters(1, 0, 2)
+
+
+class UserRecipeToggleTestCase(TestCase):
+    """Favorite and cart toggles are a single statement each"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user',
+                                            email='user@email.ru')
+        cls.recipe = Recipe.objects.create(
+            name='soup', author=cls.user, text='some_text', cooking_time=1)
+
+    def setUp(self):
+        self.client_auth = APIClient()
+        self.client_auth.force_authenticate(user=self.user)
+
+    def test_toggles(self):
+        for name, model, counter in (
+            ('recipes-favorite', Favorite, 'favorites_count'),
+            ('recipes-shopping-cart', ShoppingCart, 'in_carts_count'),
+        ):
+            url = reverse(name, args=(self.recipe.pk,))
+            for method, code, count in (
+                ('post', status.HTTP_201_CREATED, 1),
+                ('post', status.HTTP_400_BAD_REQUEST, 1),
+                ('delete', status.HTTP_204_NO_CONTENT, 0),
+                ('delete', status.HTTP_400_BAD_REQUEST, 0),
+            ):
+                with self.subTest(url=url, method=method, code=code):
+                    version = recipes_cache.version()
+                    with self.assertNumQueries(1):
+                        resp = getattr(self.client_auth, method)(url)
+                    self.assertEqual(resp.status_code, code)
+                    self.assertEqual(model.objects.count(), count)
+                    self.recipe.refresh_from_db()
+                    self.assertEqual(getattr(self.recipe, counter), count)
+                    self.assertEqual(recipes_cache.version() != version,
+                                     resp.status_code < 300)
+            self.assertEqual(self.client_auth.post(url).data['name'], 'soup')
+
+    def test_missing_recipe(self):
+        for name in ('recipes-favorite', 'recipes-shopping-cart'):
+            for pk in (self.recipe.pk + 1, 'soup', 0, -1, 2 ** 63):
+                url = reverse(name, args=(pk,))
+                for method in ('post', 'delete'):
+                    with self.subTest(url=url, method=method):
+                        resp = getattr(self.client_auth, method)(url)
+                        self.assertEqual(resp.status_code,
+                                         status.HTTP_404_NOT_FOUND)
+
+
+class BulkActionsTestCase(TestCase):
+    """Batches of favorites, cart items and subscriptions"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user',
+                                            email='user@email.ru')
+        cls.authors = [
+            User.objects.create_user(username=f'author{number}',
+                                     email=f'author{number}@email.ru')
+            for number in range(3)
+        ]
+        cls.recipes = [
+            Recipe.objects.create(name=f'soup{number}', author=author,
+                                  text='some_text', cooking_time=1)
+            for number, author in enumerate(cls.authors)
+        ]
+
+    def setUp(self):
+        self.client_auth = APIClient()
+        self.client_auth.force_authenticate(user=self.user)
+
+    def statuses(self, resp):
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return [(item['id'], item['status']) for item in resp.data['results']]
+
+    def test_recipes(self):
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        missing = third + 100
+        for name, model, counter in (
+            ('recipes-bulk-favorite', Favorite, 'favorites_count'),
+            ('recipes-bulk-shopping-cart', ShoppingCart, 'in_carts_count'),
+        ):
+            url = reverse(name)
+            model.objects.create(user=self.user, recipe=self.recipes[0])
+            with self.assertNumQueries(1):
+                resp = self.client_auth.post(
+                    url, {'ids': [first, second, missing, second, third]})
+            self.assertEqual(self.statuses(resp), [
+                (first, 'exists'), (second, 'added'),
+                (missing, 'not_found'), (third, 'added'),
+            ])
+            self.assertEqual(model.objects.filter(user=self.user).count(), 3)
+            self.assertEqual(list(Recipe.objects.order_by('pk').values_list(
+                counter, flat=True)), [1, 1, 1])
+            with self.assertNumQueries(1):
+                resp = self.client_auth.delete(url, {'ids': [second, third]})
+            self.assertEqual(self.statuses(resp), [
+                (second, 'removed'), (third, 'removed')])
+            resp = self.client_auth.delete(url, {'ids': [second, missing]})
+            self.assertEqual(self.statuses(resp), [
+                (second, 'absent'), (missing, 'not_found')])
+            self.assertEqual(list(Recipe.objects.order_by('pk').values_list(
+                counter, flat=True)), [1, 0, 0])
+
+    def test_subscriptions(self):
+        url = reverse('users-bulk-subscribe')
+        ids = [author.pk for author in self.authors]
+        Subscribe.objects.create(user=self.user, author=self.authors[0])
+        with self.assertNumQueries(3):
+            resp = self.client_auth.post(
+                url, {'ids': [*ids, self.user.pk, ids[-1] + 100]})
+        self.assertEqual(self.statuses(resp), [
+            (ids[0], 'exists'), (ids[1], 'subscribed'),
+            (ids[2], 'subscribed'), (self.user.pk, 'self'),
+            (ids[-1] + 100, 'not_found'),
+        ])
+        self.assertEqual(
+            set(FeedItem.objects.filter(user=self.user).values_list(
+                'recipe', flat=True)),
+            {recipe.pk for recipe in self.recipes})
+        with self.assertNumQueries(2):
+            resp = self.client_auth.delete(url, {'ids': ids[1:]})
+        self.assertEqual(self.statuses(resp), [
+            (ids[1], 'unsubscribed'), (ids[2], 'unsubscribed')])
+        self.assertEqual(
+            list(Subscribe.objects.filter(user=self.user).values_list(
+                'author', flat=True)), [ids[0]])
+        self.assertEqual(
+            list(FeedItem.objects.filter(user=self.user).values_list(
+                'recipe', flat=True)), [self.recipes[0].pk])
+
+    def test_validation(self):
+        for data in ({}, {'ids': []}, {'ids': ['soup']}, {'ids': [0]},
+                     {'ids': [1, 2 ** 63]},
+                     {'ids': list(range(1, BULK_MAX_ITEMS + 2))}):
+            for url in (reverse('recipes-bulk-favorite'),
+                        reverse('users-bulk-subscribe')):
+                with self.subTest(url=url, data=data):
+                    resp = self.client_auth.post(url, data)
+                    self.assertEqual(resp.status_code,
+                                     status.HTTP_400_BAD_REQUEST)
+        resp = APIClient().post(reverse('recipes-bulk-favorite'),
+                                {'ids': [1]})
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class UserRecipeRaceTestCase(TransactionTestCase):
+
+    def test_concurrent_adds(self):
+        user = User.objects.create_user(username='user',
+                                        email='user@email.ru')
+        recipe = Recipe.objects.create(
+            name='soup', author=user, text='some_text', cooking_time=1)
+        barrier = threading.Barrier(4)
+
+        def add():
+            barrier.wait()
+            try:
+                return add_recipe(Favorite, user, recipe.pk).added
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(4) as executor:
+            added = list(executor.map(lambda _: add(), range(4)))
+        self.assertEqual(sorted(added), [False, False, False, True])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+
+
 class ShoppingCartTestCase(TestCase):
 
     @classmethod
@@ -457,3 +1142,1050 @@ class ShoppingCartTestCase(TestCase):
         resp = self.client_auth.delete(url)
         self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(len(ShoppingCart.objects.all()), 0)
+
+    def test_download_shopping_cart_formats(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        url = reverse('recipes-download-shopping-cart')
+
+        resp = self.client_auth.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(resp.streaming_content).decode(),
+                         'Shopping list:\nSalt - 100 kg\n')
+
+        resp = self.client_auth.get(url, data={'format': 'csv'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(resp.streaming_content).decode(),
+                         'name,amount,measurement_unit\r\nSalt,100,kg\r\n')
+
+        resp = self.client_auth.get(url, data={'format': 'json'})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            json.loads(b''.join(resp.streaming_content)),
+            [{'name': 'Salt', 'measurement_unit': 'kg', 'amount': 100}]
+        )
+
+        resp = self.client_non_auth.get(url, data={'format': 'csv'})
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ShoppingListTestCase(TestCase):
+    """Shopping lists kept summed up as carts and recipes change"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user',
+                                            email='user@email.ru')
+        cls.other = User.objects.create_user(username='other',
+                                             email='other@email.ru')
+        cls.salt = Ingredient.objects.create(name='Salt',
+                                             measurement_unit='g')
+        cls.sugar = Ingredient.objects.create(name='Sugar',
+                                              measurement_unit='g')
+        cls.pepper = Ingredient.objects.create(name='Pepper',
+                                               measurement_unit='g')
+        cls.tag = Tag.objects.create(name='black', slug='black')
+        cls.soup, cls.cake = (
+            Recipe.objects.create(name=name, author=cls.user,
+                                  text='some_text', cooking_time=1)
+            for name in ('soup', 'cake')
+        )
+        for recipe, ingredient, amount in (
+            (cls.soup, cls.salt, 10), (cls.soup, cls.pepper, 1),
+            (cls.cake, cls.salt, 2), (cls.cake, cls.sugar, 50),
+        ):
+            RecipeIngredient.objects.create(recipe=recipe,
+                                            ingredient=ingredient,
+                                            amount=amount)
+
+    def setUp(self):
+        self.client_auth = APIClient()
+        self.client_auth.force_authenticate(user=self.user)
+
+    def shopping_list(self, user=None):
+        return dict(ShoppingListItem.objects.filter(
+            user=user or self.user
+        ).values_list('ingredient__name', 'amount'))
+
+    def assertConsistent(self):
+        """The kept lists are the ones a recount from the carts gives"""
+        kept = set(ShoppingListItem.objects.values_list(
+            'user', 'ingredient', 'amount'))
+        rebuild_shopping_lists()
+        self.assertEqual(kept, set(ShoppingListItem.objects.values_list(
+            'user', 'ingredient', 'amount')))
+
+    def test_cart_changes(self):
+        url = reverse('recipes-shopping-cart', args=(self.soup.pk,))
+        self.client_auth.post(url)
+        self.assertEqual(self.shopping_list(), {'Salt': 10, 'Pepper': 1})
+        self.client_auth.post(reverse('recipes-bulk-shopping-cart'),
+                              {'ids': [self.soup.pk, self.cake.pk]})
+        self.assertEqual(self.shopping_list(),
+                         {'Salt': 12, 'Pepper': 1, 'Sugar': 50})
+        self.client_auth.delete(url)
+        self.assertEqual(self.shopping_list(), {'Salt': 2, 'Sugar': 50})
+        ShoppingCart.objects.create(user=self.other, recipe=self.soup)
+        self.assertEqual(self.shopping_list(self.other),
+                         {'Salt': 10, 'Pepper': 1})
+        self.assertConsistent()
+        ShoppingCart.objects.filter(user=self.user).delete()
+        self.assertEqual(self.shopping_list(), {})
+        self.assertConsistent()
+
+    def test_recipe_changes(self):
+        for user in (self.user, self.other):
+            ShoppingCart.objects.create(user=user, recipe=self.soup)
+        ShoppingCart.objects.create(user=self.user, recipe=self.cake)
+        resp = self.client_auth.patch(
+            reverse('recipes-detail', args=(self.soup.pk,)), {
+                'ingredients': [{'id': self.salt.pk, 'amount': 3},
+                                {'id': self.sugar.pk, 'amount': 5}],
+                'tags': [self.tag.pk],
+            })
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.shopping_list(), {'Salt': 5, 'Sugar': 55})
+        self.assertEqual(self.shopping_list(self.other),
+                         {'Salt': 3, 'Sugar': 5})
+        self.assertConsistent()
+
+        row = RecipeIngredient.objects.get(recipe=self.cake,
+                                           ingredient=self.sugar)
+        row.amount = 40
+        row.save()
+        self.assertEqual(self.shopping_list(), {'Salt': 5, 'Sugar': 45})
+        row.ingredient = self.pepper
+        row.save()
+        self.assertEqual(self.shopping_list(),
+                         {'Salt': 5, 'Sugar': 5, 'Pepper': 40})
+        self.assertConsistent()
+
+        self.cake.delete()
+        self.assertEqual(self.shopping_list(), {'Salt': 3, 'Sugar': 5})
+        self.salt.delete()
+        self.assertEqual(self.shopping_list(), {'Sugar': 5})
+        self.assertConsistent()
+
+    def test_removed_ingredients_queries(self):
+        """Removing ingredients costs the same for any number of them"""
+        ShoppingCart.objects.create(user=self.other, recipe=self.cake)
+        extra = [Ingredient.objects.create(name=f'Spice {number}',
+                                           measurement_unit='g')
+                 for number in range(30)]
+        url = reverse('recipes-detail', args=(self.cake.pk,))
+        data = {'ingredients': [{'id': self.salt.pk, 'amount': 2}],
+                'tags': [self.tag.pk]}
+        # the first request fills the caches
+        self.client_auth.patch(url, data)
+        counts = []
+        for removed in (extra[:1], extra):
+            for ingredient in removed:
+                RecipeIngredient.objects.create(
+                    recipe=self.cake, ingredient=ingredient, amount=1)
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client_auth.patch(url, data)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(self.shopping_list(self.other), {'Salt': 2})
+        self.assertConsistent()
+
+    def test_read(self):
+        for recipe in (self.soup, self.cake):
+            ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        with self.assertNumQueries(1):
+            resp = self.client_auth.get(
+                reverse('recipes-download-shopping-cart'), {'format': 'csv'})
+            content = b''.join(resp.streaming_content).decode()
+        self.assertEqual(content, (
+            'name,amount,measurement_unit\r\nPepper,1,g\r\n'
+            'Salt,12,g\r\nSugar,50,g\r\n'))
+        with self.assertNumQueries(2):
+            resp = self.client_auth.get(
+                reverse('recipes-shopping-cart-summary'))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data['recipes'], 2)
+        self.assertEqual(resp.data['ingredients'][1], {
+            'amount': 12, 'name': 'Salt', 'measurement_unit': 'g'})
+        resp = APIClient().get(reverse('recipes-shopping-cart-summary'))
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class UnitNormalizationTestCase(TestCase):
+    """Shopping list lines merged by canonical unit and scaled"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='user',
+                                            email='user@email.ru')
+        recipe = Recipe.objects.create(name='pie', author=cls.user,
+                                       text='some_text', cooking_time=1)
+        for name, unit, amount in (
+            ('мука', 'г', 300), ('мука', 'кг', 2), ('мука', ' КГ. ', 1),
+            ('молоко', 'стакан', 1), ('молоко', 'мл', 50),
+            ('молоко', 'ст. л.', 2), ('яйца', 'шт', 2), ('яйца', 'шт.', 1),
+            ('соль', 'по вкусу', 1), ('мята', 'веточка', 3),
+        ):
+            RecipeIngredient.objects.create(
+                recipe=recipe, amount=amount,
+                ingredient=Ingredient.objects.create(
+                    name=name, measurement_unit=unit))
+        ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        self.client_auth = APIClient()
+        self.client_auth.force_authenticate(user=self.user)
+
+    def test_merged_lines(self):
+        url = reverse('recipes-download-shopping-cart')
+        expected = [
+            {'name': 'молоко', 'measurement_unit': 'мл', 'amount': 330},
+            {'name': 'мука', 'measurement_unit': 'г', 'amount': 3300},
+            {'name': 'мята', 'measurement_unit': 'веточка', 'amount': 3},
+            {'name': 'соль', 'measurement_unit': 'по вкусу', 'amount': 1},
+            {'name': 'яйца', 'measurement_unit': 'шт.', 'amount': 3},
+        ]
+        resp = self.client_auth.get(url, {'format': 'json'})
+        self.assertEqual(json.loads(b''.join(resp.streaming_content)),
+                         expected)
+        with self.assertNumQueries(1):
+            resp = self.client_auth.get(url, {'format': 'json',
+                                              'servings': 4})
+            self.assertEqual(
+                json.loads(b''.join(resp.streaming_content)),
+                [{**row, 'amount': row['amount'] * 4} for row in expected])
+        resp = self.client_auth.get(reverse('recipes-shopping-cart-summary'),
+                                    {'servings': 2})
+        self.assertEqual(resp.data['servings'], 2)
+        self.assertEqual(resp.data['ingredients'][1]['amount'], 6600)
+
+    def test_unit_table(self):
+        MeasurementUnit.objects.create(name=' Веточка ', canonical_name='г',
+                                       factor=2)
+        resp = self.client_auth.get(reverse('recipes-shopping-cart-summary'))
+        self.assertIn({'name': 'мята', 'measurement_unit': 'г', 'amount': 6},
+                      resp.data['ingredients'])
+        MeasurementUnit.objects.filter(name='кг').update(factor=100)
+        resp = self.client_auth.get(reverse('recipes-shopping-cart-summary'))
+        self.assertIn(
+            {'name': 'мука', 'measurement_unit': 'г', 'amount': 1500},
+            resp.data['ingredients'])
+
+    def test_invalid_servings(self):
+        for servings in ('0', 'two', SERVINGS_MAX_VALUE + 1):
+            with self.subTest(servings=servings):
+                resp = self.client_auth.get(
+                    reverse('recipes-download-shopping-cart'),
+                    {'servings': servings, 'format': 'json'})
+                self.assertEqual(resp.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeSearchTestCase(TestCase):
+    """Full-text search over name, ingredient names and text"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='cook', email='cook@email.ru')
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.chicken = Ingredient.objects.create(name='Курица',
+                                                measurement_unit='г')
+        cls.garlic = Ingredient.objects.create(name='Чеснок',
+                                               measurement_unit='г')
+        cls.roast = Recipe.objects.create(
+            author=cls.user, name='Курица с чесноком',
+            text='Запекать в духовке', cooking_time=40)
+        cls.soup = Recipe.objects.create(
+            author=cls.user, name='Суп',
+            text='Сварить бульон, добавить чеснок', cooking_time=30)
+        cls.salad = Recipe.objects.create(
+            author=cls.user, name='Салат', text='Нарезать овощи',
+            cooking_time=10)
+        cls.soup.tags.add(cls.tag)
+        RecipeIngredient.objects.create(recipe=cls.soup,
+                                        ingredient=cls.chicken, amount=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, **params):
+        resp = self.client.get(reverse('recipes-list'),
+                               {'limit': 10, **params})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return [recipe['id'] for recipe in resp.data['results']]
+
+    def test_search_ranks_name_above_ingredients_and_text(self):
+        self.assertEqual(self.search(search='курица чеснок'),
+                         [self.roast.id, self.soup.id])
+        self.assertEqual(self.search(search='курицы'),
+                         [self.roast.id, self.soup.id])
+        self.assertEqual(self.search(search='овощи'), [self.salad.id])
+
+    def test_search_combines_with_filters(self):
+        self.assertEqual(self.search(search='курица', tags='lunch'),
+                         [self.soup.id])
+        Favorite.objects.create(user=self.user, recipe=self.roast)
+        self.assertEqual(self.search(search='курица', is_favorited=1),
+                         [self.roast.id])
+
+    def test_search_vector_follows_ingredient_changes(self):
+        url = reverse('recipes-detail', args=(self.salad.pk,))
+        resp = self.client.patch(url, data={
+            'ingredients': [{'id': self.garlic.id, 'amount': 2}],
+        }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn(self.salad.id, self.search(search='чеснок'))
+        self.garlic.name = 'Лук'
+        self.garlic.save()
+        self.assertNotIn(self.salad.id, self.search(search='чеснок'))
+        self.assertEqual(self.search(search='лук'), [self.salad.id])
+
+    def test_removed_ingredients_refresh_search_vector_once(self):
+        spices = [Ingredient.objects.create(name=f'Специя {number}',
+                                            measurement_unit='г')
+                  for number in range(30)]
+        for spice in spices:
+            RecipeIngredient.objects.create(recipe=self.salad,
+                                            ingredient=spice, amount=1)
+        url = reverse('recipes-detail', args=(self.salad.pk,))
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.patch(url, data={
+                'ingredients': [{'id': self.garlic.id, 'amount': 2}],
+            }, format='json')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(sum(
+            query['sql'].startswith('UPDATE "recipes_recipe" SET '
+                                    '"search_vector"')
+            for query in queries), 1)
+        self.assertEqual(self.search(search='специя'), [])
+        self.assertIn(self.salad.id, self.search(search='чеснок'))
+
+    def test_recipe_writes_refresh_search_vector_once(self):
+        def refreshes(method, url, data):
+            with CaptureQueriesContext(connection) as queries:
+                resp = getattr(self.client, method)(url, data=data,
+                                                    format='json')
+            self.assertIn(resp.status_code,
+                          (status.HTTP_200_OK, status.HTTP_201_CREATED))
+            return resp, sum(
+                query['sql'].startswith('UPDATE "recipes_recipe" SET '
+                                        '"search_vector"')
+                for query in queries)
+
+        resp, count = refreshes('post', reverse('recipes-list'), {
+            'name': 'Плов', 'text': 'Тушить', 'cooking_time': 60,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.chicken.id, 'amount': 3}],
+        })
+        self.assertEqual(count, 1)
+        url = reverse('recipes-detail', args=(resp.data['id'],))
+        _, count = refreshes('patch', url, {
+            'name': 'Плов с чесноком',
+            'ingredients': [{'id': self.garlic.id, 'amount': 1}],
+        })
+        self.assertEqual(count, 1)
+        _, count = refreshes('patch', url, {'cooking_time': 50})
+        self.assertEqual(count, 0)
+        self.assertIn(resp.data['id'], self.search(search='чеснок'))
+
+
+class WhatToCookTestCase(TestCase):
+    """Recipes ranked by how fully the given ingredients cover them"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='cook', email='cook@email.ru')
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('Яйцо', 'Молоко', 'Мука', 'Соль')
+        )
+        cls.egg, cls.milk, cls.flour, cls.salt = ingredients
+        cls.omelette = cls.create_recipe('Омлет', cls.egg, cls.milk)
+        cls.pancakes = cls.create_recipe('Блины', cls.egg, cls.milk,
+                                         cls.flour)
+        cls.bread = cls.create_recipe('Хлеб', cls.flour, cls.salt)
+
+    @classmethod
+    def create_recipe(cls, name, *ingredients):
+        recipe = Recipe.objects.create(author=cls.user, name=name,
+                                       text='text', cooking_time=10)
+        for ingredient in ingredients:
+            RecipeIngredient.objects.create(recipe=recipe,
+                                            ingredient=ingredient, amount=1)
+        return recipe
+
+    def what_to_cook(self, *ingredients, **params):
+        return APIClient().get(reverse('recipes-what-to-cook'), {
+            'ingredients': [ingredient.id for ingredient in ingredients],
+            **params
+        })
+
+    def test_ranked_by_coverage(self):
+        resp = self.what_to_cook(self.egg, self.milk, limit=10)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        results = resp.data['results']
+        self.assertEqual([recipe['id'] for recipe in results],
+                         [self.omelette.id, self.pancakes.id])
+        self.assertEqual([recipe['coverage'] for recipe in results],
+                         [1.0, 2 / 3])
+        self.assertEqual(results[0]['missing_ingredients'], [])
+        self.assertEqual(
+            [row['id'] for row in results[1]['missing_ingredients']],
+            [self.flour.id]
+        )
+
+    def test_index_follows_recipe_ingredients(self):
+        RecipeIngredient.objects.filter(recipe=self.bread,
+                                        ingredient=self.salt).delete()
+        resp = self.what_to_cook(self.flour)
+        self.assertEqual([recipe['id'] for recipe in resp.data],
+                         [self.bread.id, self.pancakes.id])
+
+    def test_candidates_come_from_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = Recipe.objects.covered_by([self.egg.id]).explain()
+        self.assertIn('recipe_ingredient_ids_idx', plan)
+
+    def test_ingredients_required(self):
+        resp = APIClient().get(reverse('recipes-what-to-cook'))
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_ingredient_ids_out_of_range(self):
+        url = reverse('recipes-what-to-cook')
+        resp = APIClient().get(url, {'ingredients': 2 ** 31})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.data, [])
+        resp = APIClient().get(url, {'ingredients': 2 ** 63})
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FeedTestCase(TestCase):
+    """Recipes are fanned out to subscribers' feeds on write"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create(username='reader',
+                                         email='reader@email.ru')
+        cls.author = User.objects.create(username='author',
+                                         email='author@email.ru')
+        cls.stranger = User.objects.create(username='stranger',
+                                           email='stranger@email.ru')
+        cls.old_recipe = cls.create_recipe(cls.author, 'Старый рецепт')
+        Subscribe.objects.create(user=cls.reader, author=cls.author)
+
+    @classmethod
+    def create_recipe(cls, author, name):
+        return Recipe.objects.create(author=author, name=name, text='text',
+                                     cooking_time=10)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def feed(self, **params):
+        resp = self.client.get(reverse('recipes-feed'),
+                               {'limit': 10, **params})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        return resp
+
+    def feed_ids(self):
+        return [recipe['id'] for recipe in self.feed().data['results']]
+
+    def test_feed_gets_new_and_backfilled_recipes(self):
+        recipe = self.create_recipe(self.author, 'Новый рецепт')
+        self.create_recipe(self.stranger, 'Чужой рецепт')
+        self.assertEqual(self.feed_ids(), [recipe.id, self.old_recipe.id])
+
+    def test_unsubscribe_cleans_feed(self):
+        Subscribe.objects.filter(user=self.reader).delete()
+        self.assertEqual(self.feed_ids(), [])
+        Subscribe.objects.create(user=self.reader, author=self.stranger)
+        self.assertEqual(self.feed_ids(), [])
+
+    def test_feed_is_bounded(self):
+        with mock.patch('recipes.feed.FEED_MAX_LENGTH', 2):
+            recipes = [self.create_recipe(self.author, f'Рецепт {i}')
+                       for i in range(3)]
+        self.assertEqual(self.feed_ids(), [recipes[2].id, recipes[1].id])
+
+    def test_feed_keyset_pages(self):
+        recipe = self.create_recipe(self.author, 'Новый рецепт')
+        resp = self.feed(limit=1, cursor='')
+        self.assertEqual([item['id'] for item in resp.data['results']],
+                         [recipe.id])
+        resp = self.client.get(resp.data['next'])
+        self.assertEqual([item['id'] for item in resp.data['results']],
+                         [self.old_recipe.id])
+        self.assertIsNone(resp.data['next'])
+
+    def test_feed_query_count(self):
+        for i in range(3):
+            self.create_recipe(self.author, f'Рецепт {i}')
+        with CaptureQueriesContext(connection) as few:
+            self.feed(cursor='')
+        for i in range(10):
+            self.create_recipe(self.author, f'Еще рецепт {i}')
+        with CaptureQueriesContext(connection) as many:
+            self.feed(cursor='')
+        self.assertEqual(len(few), len(many))
+
+    def test_backfill_command(self):
+        FeedItem.objects.all().delete()
+        call_command('backfill_feeds', stdout=StringIO())
+        self.assertEqual(self.feed_ids(), [self.old_recipe.id])
+
+
+class SubscriptionsRecipesTestCase(TestCase):
+    """Recipes of followed authors are loaded in one windowed query"""
+    RECIPES = 4
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create(username='reader',
+                                         email='reader@email.ru')
+        cls.authors = []
+        for i in range(3):
+            author = User.objects.create(username=f'author{i}',
+                                         email=f'author{i}@email.ru')
+            cls.authors.append(author)
+            for j in range(cls.RECIPES):
+                Recipe.objects.create(author=author, name=f'Рецепт {j}',
+                                      text='text', cooking_time=10)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def subscriptions(self, **params):
+        return self.client.get(reverse('users-subscriptions'),
+                               {'limit': 10, **params})
+
+    def test_recipes_limit_from_query_string(self):
+        for author in self.authors:
+            Subscribe.objects.create(user=self.reader, author=author)
+        resp = self.subscriptions(recipes_limit=2)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        for author in resp.data['results']:
+            newest = Recipe.objects.filter(
+                author=author['id']).order_by('-creation_date', '-id')
+            self.assertEqual([recipe['id'] for recipe in author['recipes']],
+                             [recipe.id for recipe in newest[:2]])
+            self.assertEqual(author['recipes_count'], self.RECIPES)
+        resp = self.subscriptions()
+        self.assertEqual([len(author['recipes'])
+                          for author in resp.data['results']],
+                         [self.RECIPES] * len(self.authors))
+
+    def test_invalid_recipes_limit(self):
+        resp = self.subscriptions(recipes_limit='many')
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_constant_query_count(self):
+        Subscribe.objects.create(user=self.reader, author=self.authors[0])
+        with CaptureQueriesContext(connection) as one:
+            self.subscriptions(recipes_limit=2)
+        for author in self.authors[1:]:
+            Subscribe.objects.create(user=self.reader, author=author)
+        with CaptureQueriesContext(connection) as many:
+            self.subscriptions(recipes_limit=2)
+        self.assertEqual(len(one), len(many))
+
+
+class ConditionalGetTestCase(TestCase):
+    """Unchanged resources are answered with 304 Not Modified"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='cook', email='cook@email.ru')
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.ingredient = Ingredient.objects.create(name='Соль',
+                                                   measurement_unit='г')
+        cls.recipe = Recipe.objects.create(author=cls.user, name='Суп',
+                                           text='text', cooking_time=10)
+
+    def revalidate(self, client, url):
+        resp = client.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        etag = resp['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            resp = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(resp.content, b'')
+        # a recipe page looks its author up, lists run no queries
+        self.assertEqual(len(queries), int(resolve(url).url_name
+                                           == 'recipes-detail'))
+        return etag
+
+    def test_not_modified_until_change(self):
+        client = APIClient()
+        cases = (
+            (reverse('tags-list'), lambda: Tag.objects.create(
+                name='Ужин', slug='dinner')),
+            (reverse('ingredients-list'), lambda: Ingredient.objects.create(
+                name='Перец', measurement_unit='г')),
+            (reverse('recipes-list'), lambda: Favorite.objects.create(
+                user=self.user, recipe=self.recipe)),
+            (reverse('recipes-detail', args=(self.recipe.pk,)),
+             lambda: RecipeIngredient.objects.create(
+                 recipe=self.recipe, ingredient=self.ingredient, amount=1)),
+        )
+        for url, change in cases:
+            with self.subTest(url=url):
+                etag = self.revalidate(client, url)
+                change()
+                resp = client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                self.assertNotEqual(resp['ETag'], etag)
+
+    def test_recipe_etag_is_scoped(self):
+        url = reverse('recipes-detail', args=(self.recipe.pk,))
+        other = Recipe.objects.create(author=self.user, name='Каша',
+                                      text='text', cooking_time=10)
+        reader = User.objects.create(username='reader',
+                                     email='reader@email.ru')
+        client = APIClient()
+        client.force_authenticate(reader)
+        unrelated = (
+            lambda: Favorite.objects.create(user=reader, recipe=other),
+            lambda: ShoppingCart.objects.create(user=self.user,
+                                                recipe=other),
+            lambda: client.post(reverse('recipes-favorite',
+                                        args=(other.pk,))),
+        )
+        related = (
+            lambda: client.post(reverse('recipes-shopping-cart',
+                                        args=(self.recipe.pk,))),
+            lambda: Subscribe.objects.create(user=reader, author=self.user),
+            lambda: Tag.objects.create(name='Ужин', slug='dinner'),
+        )
+        etag = self.revalidate(client, url)
+        for change in unrelated:
+            change()
+            resp = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        for change in related:
+            change()
+            resp = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            etag = resp['ETag']
+
+    def test_any_etag_matches_existing_recipes_only(self):
+        client = APIClient()
+        resp = client.get(reverse('recipes-detail', args=(self.recipe.pk,)),
+                          HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        for pk in (self.recipe.pk + 1000, 'soup'):
+            with self.subTest(pk=pk):
+                resp = client.get(reverse('recipes-detail', args=(pk,)),
+                                  HTTP_IF_NONE_MATCH='*')
+                self.assertEqual(resp.status_code,
+                                 status.HTTP_404_NOT_FOUND)
+
+    def test_etag_depends_on_user(self):
+        url = reverse('recipes-list')
+        etag = self.revalidate(APIClient(), url)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        resp = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+
+@override_settings(PROFILING_SAMPLE_RATE=1, SLOW_REQUEST_MS=0)
+class ProfilingMiddlewareTestCase(TestCase):
+    """Sampled requests get Server-Timing and a slow-request log"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create(
+            User(username=f'user{i}', email=f'user{i}@email.ru')
+            for i in range(3)
+        )
+
+    def test_server_timing_and_duplicate_queries(self):
+        client = APIClient()
+        client.force_authenticate(self.users[0])
+        with self.assertLogs('api.middleware', 'WARNING') as logs:
+            resp = client.get(reverse('users-list'), {'limit': 10})
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        for metric in ('db;dur=', 'queries"', 'view;dur=', 'render;dur=',
+                       'total;dur='):
+            self.assertIn(metric, resp['Server-Timing'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'users-list')
+        self.assertEqual(record['size'], len(resp.content))
+        self.assertRegex(resp['Server-Timing'],
+                         rf'render;dur=[\d.]+;desc="{len(resp.content)} '
+                         'bytes"')
+        self.assertIn(len(self.users), [
+            query['count'] for query in record['duplicate_queries']
+            if 'users_subscribe' in query['sql']
+        ])
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_disabled(self):
+        resp = APIClient().get(reverse('tags-list'))
+        self.assertNotIn('Server-Timing', resp)
+
+
+class MetricsTestCase(TestCase):
+    """/metrics sums the values flushed by every worker process"""
+
+    def setUp(self):
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir)
+        settings = override_settings(METRICS_DIR=self.metrics_dir,
+                                     METRICS_FLUSH_INTERVAL=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_exposition(self):
+        user = User.objects.create(username='cook', email='cook@email.ru')
+        token = Token.objects.create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        for _ in range(2):
+            self.assertEqual(client.get(reverse('tags-list')).status_code,
+                             status.HTTP_200_OK)
+        with open(os.path.join(self.metrics_dir, '999999999.json'),
+                  'w') as file:
+            json.dump([
+                ['foodgram_db_queries_total', [['route', 'other']], 5],
+                ['foodgram_db_connections_open', [], 7],
+            ], file)
+        resp = client.get(reverse('metrics'))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertTrue(resp['Content-Type'].startswith('text/plain'))
+        lines = resp.content.decode().splitlines()
+        self.assertIn('# TYPE foodgram_request_duration_seconds histogram',
+                      lines)
+        self.assertIn('foodgram_request_duration_seconds_count'
+                      '{method="GET",route="tags-list",status="200"} 2.0',
+                      lines)
+        self.assertIn('foodgram_db_queries_total{route="other"} 5.0', lines)
+        self.assertIn('foodgram_db_connections_open 1.0', lines)
+        for name in ('foodgram_token_auth_duration_seconds_count',
+                     'foodgram_cache_requests_total{cache="tags"'):
+            self.assertTrue([line for line in lines
+                             if line.startswith(name)])
+
+    def test_concurrent_flushes(self):
+        errors = []
+
+        def flush():
+            try:
+                for _ in range(50):
+                    registry.flush()
+            except OSError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=flush) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(self.metrics_dir),
+                         [f'{os.getpid()}.json'])
+
+    def test_reused_pid_keeps_totals(self):
+        key = ('foodgram_db_queries_total', (('route', 'other'),))
+        with open(os.path.join(self.metrics_dir, f'{os.getpid()}.json'),
+                  'w') as file:
+            json.dump([
+                ['foodgram_db_queries_total', [['route', 'other']], 5],
+                ['foodgram_db_connections_open', [], 7],
+            ], file)
+        inherited = registry.inherited
+        registry.inherited = None
+        self.addCleanup(setattr, registry, 'inherited', inherited)
+        before = registry.collect().get(key, 0)
+        values = read_values()
+        self.assertEqual(values[key], before + 5)
+        self.assertEqual(values.get(('foodgram_db_connections_open', ())),
+                         registry.collect().get(
+                             ('foodgram_db_connections_open', ())))
+        self.assertEqual(read_values()[key], before + 5)
+
+    def test_internal_only(self):
+        client = APIClient()
+        self.assertEqual(
+            client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.2').status_code,
+            status.HTTP_200_OK)
+        self.assertEqual(
+            client.get(reverse('metrics'),
+                       REMOTE_ADDR='8.8.8.8').status_code,
+            status.HTTP_404_NOT_FOUND)
+        self.assertEqual(
+            client.get(reverse('metrics'),
+                       HTTP_X_FORWARDED_FOR='8.8.8.8').status_code,
+            status.HTTP_404_NOT_FOUND)
+
+    @override_settings(METRICS_DIR='')
+    def test_disabled(self):
+        resp = APIClient().get(reverse('metrics'))
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BenchmarkTestCase(TestCase):
+    """Synthetic data generator and the benchmark harness"""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('seed_synthetic', users=20, recipes=60, ingredients=30,
+                     favorites_per_user=5, carts_per_user=2,
+                     subscriptions_per_user=4, stdout=StringIO())
+
+    def test_seed_keeps_derived_data(self):
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Recipe.objects.count(), 60)
+        self.assertEqual(set(reconcile_counters().values()), {0})
+        self.assertFalse(Recipe.objects.filter(search_vector=None).exists())
+        self.assertFalse(Recipe.objects.filter(ingredient_ids=[]).exists())
+        self.assertTrue(FeedItem.objects.exists())
+        popular, *_, rare = Recipe.objects.order_by('id')
+        self.assertGreater(popular.favorites_count, rare.favorites_count)
+
+    def test_benchmark_report(self):
+        output = StringIO()
+        call_command('benchmark', requests=3, warmup=1, stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(report['meta']['data']['recipes'], 60)
+        for name in ('recipes_list', 'recipes_filtered', 'subscriptions',
+                     'download_shopping_cart', 'ingredients_name'):
+            result = report['scenarios'][name]
+            self.assertEqual(result['status_codes'], {'200': 3})
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertGreater(
+            report['scenarios']['recipes_list']['queries_per_request'], 0)
+        # served from the reference cache after the warm-up
+        self.assertEqual(
+            report['scenarios']['ingredients_name']['queries_per_request'],
+            0)
+
+    def test_benchmark_connections(self):
+        output = StringIO()
+        call_command('benchmark', requests=8, warmup=0, connections=True,
+                     concurrency=2, scenario=['recipes_list'], stdout=output)
+        result = json.loads(output.getvalue())['connections']
+        self.assertEqual(result['new']['connections_opened'], 8)
+        self.assertEqual(result['persistent']['connections_opened'], 2)
+        self.assertLessEqual(result['pooled']['connections_opened'], 2)
+
+    def test_benchmark_baseline(self):
+        path = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        call_command('benchmark', requests=2, warmup=0, output=path,
+                     scenario=['recipes_list'])
+        output = StringIO()
+        call_command('benchmark', requests=2, warmup=0, baseline=path,
+                     scenario=['recipes_list'], stdout=output)
+        result = json.loads(output.getvalue())['scenarios']['recipes_list']
+        self.assertIn('p95_ms', result['change_percent'])
+
+
+class ConnectionPoolTestCase(TestCase):
+    """Database connections are reused and checked before reuse"""
+
+    def wrapper(self, **settings):
+        wrapper = DatabaseWrapper({**connection.settings_dict, **settings},
+                                  alias='pooled')
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def test_pool_reuses_connections(self):
+        self.addCleanup(close_pools)
+        pool = {'POOL': {'SIZE': 1, 'TIMEOUT': 0.1}}
+        first = self.wrapper(**pool)
+        first.ensure_connection()
+        raw = first.connection
+        self.assertFalse(first.reused)
+        busy = self.wrapper(**pool)
+        with self.assertRaises(OperationalError):
+            busy.ensure_connection()
+        first.close()
+        self.assertFalse(raw.closed)
+        busy.ensure_connection()
+        self.assertTrue(busy.reused)
+        self.assertIs(busy.connection, raw)
+        values = registry.collect()
+        for name in ('foodgram_db_pool_wait_seconds_count',
+                     'foodgram_db_pool_timeouts_total',
+                     'foodgram_db_connections_reused_total'):
+            self.assertGreater(values[name, (('alias', 'pooled'),)], 0)
+
+    def test_health_check(self):
+        persistent = self.wrapper(CONN_MAX_AGE=60, CONN_HEALTH_CHECKS=True)
+        persistent.ensure_connection()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_terminate_backend(%s)',
+                           [persistent.connection.get_backend_pid()])
+        persistent.close_if_unusable_or_obsolete()
+        persistent.idle_since -= HEALTH_CHECK_IDLE_SECONDS + 1
+        with persistent.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone(), (1,))
+
+
+class TokenCacheTestCase(TestCase):
+    """Token lookups are cached until logout or a change of the user"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='cook', email='cook@email.ru', password='old-Pa55word')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.url = reverse('users-me')
+
+    def get_me(self):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(self.url)
+        tokens = [query for query in queries
+                  if 'authtoken_token' in query['sql']]
+        return resp.status_code, len(tokens)
+
+    def assert_cached(self):
+        self.assertEqual(self.get_me(), (status.HTTP_200_OK, 1))
+        self.assertEqual(self.get_me(), (status.HTTP_200_OK, 0))
+
+    def test_hit_and_miss_metrics(self):
+        before = registry.collect()
+        self.assert_cached()
+        values = registry.collect()
+        for result in ('miss', 'local_hit'):
+            key = ('foodgram_token_cache_requests_total',
+                   (('result', result),))
+            self.assertEqual(values[key] - before.get(key, 0), 1)
+
+    def test_logout(self):
+        self.assert_cached()
+        resp = self.client.post(reverse('logout'))
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.get_me(),
+                         (status.HTTP_401_UNAUTHORIZED, 1))
+
+    def test_set_password(self):
+        self.assert_cached()
+        resp = self.client.post(reverse('users-set-password'), {
+            'current_password': 'old-Pa55word',
+            'new_password': 'new-Pa55word',
+        })
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assert_cached()
+
+    def test_set_email_keeps_counters(self):
+        self.assert_cached()
+        Recipe.objects.create(name='soup', author=self.user,
+                              text='some_text', cooking_time=1)
+        resp = self.client.post(reverse('users-set-username'), {
+            'current_password': 'old-Pa55word',
+            'new_email': 'chef@email.ru',
+        })
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, 'chef@email.ru')
+        self.assertEqual(self.user.recipes_count, 1)
+
+    def test_deactivation(self):
+        self.assert_cached()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get_me(),
+                         (status.HTTP_401_UNAUTHORIZED, 1))
+
+    def test_request_racing_logout(self):
+        key = self.token.key
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+            # a request that still sees the token before the commit
+            token_cache.set(key, self.user, token_cache.generation(key))
+            self.assertIsNotNone(token_cache.get(key))
+        self.assertIsNone(token_cache.get(key))
+
+
+class AsyncViewsTestCase(TransactionTestCase):
+    """Async views answer like the sync ones they stand in for"""
+
+    def setUp(self):
+        # worker threads must not keep connections to the test database
+        max_age = mock.patch.dict(connection.settings_dict, CONN_MAX_AGE=0)
+        max_age.start()
+        self.addCleanup(max_age.stop)
+        self.user = User.objects.create(username='cook', email='cook@email.ru')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        salt = Ingredient.objects.create(name='Соль', measurement_unit='г')
+        tag = Tag.objects.create(name='Обед', slug='lunch')
+        for number in range(3):
+            recipe = Recipe.objects.create(
+                author=self.user, name=f'Суп {number}', text='text',
+                cooking_time=10)
+            recipe.tags.add(tag)
+            RecipeIngredient.objects.create(recipe=recipe, ingredient=salt,
+                                            amount=number + 1)
+        self.recipe = recipe
+        Favorite.objects.create(user=self.user, recipe=recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+
+    def async_get(self, url, method='GET', authorized=True, **headers):
+        if authorized:
+            headers['authorization'] = f'Token {self.token.key}'
+
+        async def request():
+            return await AsyncClient().generic(method, url, **headers)
+
+        with self.settings(ROOT_URLCONF='foodgram.urls_async'):
+            return async_to_sync(request)()
+
+    def test_views_are_async(self):
+        for url in ('/api/recipes/', f'/api/recipes/{self.recipe.pk}/',
+                    '/api/recipes/download_shopping_cart/', '/api/tags/',
+                    '/api/ingredients/'):
+            with self.subTest(url=url):
+                view = resolve(url, urlconf='foodgram.urls_async').func
+                self.assertTrue(asyncio.iscoroutinefunction(view))
+
+    def test_same_responses(self):
+        urls = (
+            '/api/recipes/', '/api/recipes/?limit=2',
+            '/api/recipes/?limit=2&page=2', '/api/recipes/?is_favorited=1',
+            '/api/recipes/?limit=1&cursor=',
+            f'/api/recipes/{self.recipe.pk}/', '/api/tags/',
+            '/api/ingredients/?name=%D1%81%D0%BE',
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                expected = self.client.get(url)
+                resp = self.async_get(url)
+                self.assertEqual(resp.status_code, status.HTTP_200_OK)
+                self.assertEqual(json.loads(resp.content), expected.json())
+                self.assertEqual(resp['ETag'], expected['ETag'])
+                resp = self.async_get(url, **{'if-none-match': resp['ETag']})
+                self.assertEqual(resp.status_code,
+                                 status.HTTP_304_NOT_MODIFIED)
+
+    def test_errors(self):
+        for url, code in (('/api/recipes/?limit=2&page=9',
+                           status.HTTP_404_NOT_FOUND),
+                          ('/api/recipes/0/', status.HTTP_404_NOT_FOUND),
+                          ('/api/recipes/soup/', status.HTTP_404_NOT_FOUND)):
+            with self.subTest(url=url):
+                self.assertEqual(self.async_get(url).status_code, code)
+        resp = self.async_get('/api/recipes/download_shopping_cart/',
+                              authorized=False)
+        self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_download_shopping_cart(self):
+        resp = self.async_get(
+            '/api/recipes/download_shopping_cart/?format=csv')
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(resp.streaming_content).decode(),
+                         'name,amount,measurement_unit\r\nСоль,3,г\r\n')
+
+    def test_other_methods_use_viewset(self):
+        resp = self.async_get(f'/api/recipes/{self.recipe.pk}/',
+                              method='DELETE')
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Recipe.objects.filter(pk=self.recipe.pk).exists())
@@ -1,25 +1,24 @@
-from django.db.models import Sum
+from django.db.models import F, Sum
 
-from recipes.models import RecipeIngredient
+from recipes.models import ShoppingListItem
+from recipes.units import with_canonical_units
 
+SHOPPING_LIST_CHUNK_SIZE = 2000
 
-def ingredients_in_cart(shopping_cart):
-    recipes = shopping_cart.values_list('recipe_id', flat=True)
-    ingredients = RecipeIngredient.objects.filter(
-        recipe__in=recipes
+
+def shopping_list(user, servings=1):
+    """Cart rows summed up by canonical unit, read lazily
+
+    The rows are read through a server-side cursor.
+    """
+    return with_canonical_units(
+        ShoppingListItem.objects.filter(user=user),
+        'ingredient', servings
     ).values(
-        'ingredient__name',
-        'ingredient__measurement_unit'
+        name=F('ingredient__name'),
+        measurement_unit=F('canonical_unit'),
     ).annotate(
-        amount=Sum('amount')
+        amount=Sum('canonical_amount')
     ).order_by(
-        'ingredient__name'
-    )
-    ingredients_in_cart = 'Shopping list:\n'
-    for ingredient in ingredients:
-        ingredients_in_cart += (
-            f'{ingredient["ingredient__name"]}'
-            f' - {ingredient["amount"]}'
-            f' {ingredient["ingredient__measurement_unit"]}\n'
-        )
-    return ingredients_in_cart
+        'name', 'measurement_unit'
+    ).iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)
@@ -1,31 +1,67 @@
+from ipaddress import ip_address
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import HttpResponse
+from django.db.models import BooleanField, F, Value
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import AllowAny, SAFE_METHODS, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.viewsets import ModelViewSet
 
+from api.metrics import CONTENT_TYPE, exposition
+from api.mixins import CachedListMixin, ConditionalGetMixin
 from api.permissions import ReadOnly, IsOwnerOrReadOnly
-from api.serializers import (IngredientSerializer,
+from api.renderers import SHOPPING_LIST_RENDERERS
+from api.serializers import (AutocompleteSerializer, BulkSerializer,
+                             IngredientSerializer,
+                             CookableRecipeSerializer, WhatToCookSerializer,
                              RecipeListSerializer, TagSerializer,
+                             ShoppingListSerializer,
                              ShortRecipeSerializer, RecipeCreateSerializer,
                              UserSerializer, SubscribeSerializer,
-                             SubscriptionsSerializer, PasswordSerializer,
-                             FavoriteSerializer, ShoppingCartSerializer)
-from recipes.models import Ingredient, Recipe, Tag, Favorite, ShoppingCart
+                             SubscriptionsSerializer, PasswordSerializer)
+from recipes.cache import (SHARED_SCOPE, ingredients_cache, recipe_scope,
+                           recipes_cache, tags_cache, user_scope)
+from recipes.constants import ID_MAX_VALUE
+from recipes.models import (FeedItem, Ingredient, Recipe, Tag, Favorite,
+                            ShoppingCart)
+from recipes.user_recipes import (add_recipe, add_recipes, remove_recipe,
+                                  remove_recipes)
 from users.models import Subscribe
+from users.subscriptions import (subscribe_to_authors,
+                                 unsubscribe_from_authors)
 
 from .filters import IngredientFilter, RecipeFilter
-from .utils import ingredients_in_cart
-from .paginators import PageNumberPagination
+from .utils import shopping_list
+from .paginators import (FeedPagination, PageNumberPagination,
+                         PersonalFeedPagination, SubscriptionsPagination)
 
 User = get_user_model()
 
 
+CHANGED_STATUSES = ('added', 'removed', 'subscribed', 'unsubscribed')
+
+
+def bulk_response(ids, statuses, scope):
+    """Status of every requested id, in the requested order
+
+    scope gives the recipes_cache scope of a changed id.
+    """
+    recipes_cache.bump(*(scope(pk) for pk, result in statuses.items()
+                         if result in CHANGED_STATUSES))
+    return Response({'results': [
+        {'id': pk, 'status': statuses.get(pk, 'not_found')} for pk in ids
+    ]})
+
+
 class UserViewSet(DjoserUserViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
@@ -64,9 +100,13 @@ class UserViewSet(DjoserUserViewSet):
     @action(
         detail=False,
         permission_classes=[IsAuthenticated],
+        pagination_class=SubscriptionsPagination,
     )
     def subscriptions(self, request):
-        queryset = User.objects.filter(subscribers__user=request.user)
+        queryset = User.objects.filter(
+            subscribers__user=request.user
+        ).annotate(subscription_id=F('subscribers__id'),
+                   is_subscribed=Value(True, output_field=BooleanField()))
         pages = self.paginate_queryset(queryset=queryset)
         serializer = SubscriptionsSerializer(pages,
                                              context={'request': request},
@@ -88,6 +128,28 @@ class UserViewSet(DjoserUserViewSet):
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='subscribe',
+        permission_classes=[IsAuthenticated],
+    )
+    def bulk_subscribe(self, request):
+        serializer = BulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        authors = [pk for pk in ids if pk != request.user.pk]
+        if request.method == 'POST':
+            statuses = {pk: 'subscribed' if subscribed else 'exists'
+                        for pk, subscribed in subscribe_to_authors(
+                            request.user, authors).items()}
+        else:
+            statuses = {pk: 'unsubscribed' if unsubscribed else 'absent'
+                        for pk, unsubscribed in unsubscribe_from_authors(
+                            request.user, authors).items()}
+        statuses[request.user.pk] = 'self'
+        return bulk_response(ids, statuses, user_scope)
+
     @subscribe.mapping.delete
     def delete_subscribtion(self, request, id):
         get_object_or_404(
@@ -98,56 +160,122 @@ class UserViewSet(DjoserUserViewSet):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class IngredientViewSet(ModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, CachedListMixin, ModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (ReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    reference_cache = ingredients_cache
+    version_cache = ingredients_cache
+
+    @action(detail=False)
+    def autocomplete(self, request):
+        serializer = AutocompleteSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return self.cached_response(
+            request, lambda: self.autocomplete_response(
+                **serializer.validated_data)
+        )
 
+    def autocomplete_response(self, name, limit):
+        ingredients = Ingredient.objects.autocomplete(name, limit)
+        return Response(self.get_serializer(ingredients, many=True).data)
 
-class RecipesViewSet(ModelViewSet):
+
+class RecipesViewSet(ConditionalGetMixin, ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = (IsOwnerOrReadOnly, )
-    pagination_class = PageNumberPagination
-    filter_backends = (DjangoFilterBackend,)
+    version_cache = recipes_cache
+    pagination_class = FeedPagination
+    filter_backends = (DjangoFilterBackend, OrderingFilter)
     filterset_class = RecipeFilter
+    ordering_fields = ('creation_date', 'favorites_count', 'in_carts_count')
+
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            return Recipe.objects.for_list(self.request.user)
+        return super().get_queryset()
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def get_etag_scopes(self):
+        """A recipe page changes with the recipe and with its author"""
+        if self.action != 'retrieve':
+            return None
+        pk = self.recipe_id(self.kwargs['pk'])
+        author = Recipe.objects.filter(pk=pk).values_list(
+            'author_id', flat=True).first()
+        if author is None:
+            raise Http404
+        return SHARED_SCOPE, recipe_scope(pk), user_scope(author)
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeListSerializer
         return RecipeCreateSerializer
 
+    def add_recipe(self, model, pk, message):
+        recipe = add_recipe(model, self.request.user, self.recipe_id(pk))
+        if recipe is None:
+            raise Http404
+        if not recipe.added:
+            raise ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [message]})
+        recipes_cache.bump(recipe_scope(recipe.pk))
+        return Response(ShortRecipeSerializer(recipe).data,
+                        status=status.HTTP_201_CREATED)
+
+    def remove_recipe(self, model, pk, message):
+        pk = self.recipe_id(pk)
+        removed = remove_recipe(model, self.request.user, pk)
+        if removed is None:
+            raise Http404
+        if not removed:
+            raise ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [message]})
+        recipes_cache.bump(recipe_scope(pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def change_recipes(self, model):
+        serializer = BulkSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        if self.request.method == 'POST':
+            statuses = {
+                recipe.id: 'added' if recipe.added else 'exists'
+                for recipe in add_recipes(model, self.request.user, ids)
+            }
+        else:
+            statuses = {
+                pk: 'removed' if removed else 'absent'
+                for pk, removed in remove_recipes(
+                    model, self.request.user, ids).items()
+            }
+        return bulk_response(ids, statuses, recipe_scope)
+
+    def recipe_id(self, pk):
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise Http404
+        if not 0 < pk <= ID_MAX_VALUE:
+            raise Http404
+        return pk
+
     @action(
         detail=True,
         methods=['post'],
         permission_classes=[IsAuthenticated]
     )
     def favorite(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        serializer = FavoriteSerializer(
-            data={'user': request.user.id, 'recipe': pk},
-            context={'request': request}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(
-            ShortRecipeSerializer(recipe).data,
-            status=status.HTTP_201_CREATED
-        )
+        return self.add_recipe(Favorite, pk, 'Рецепт уже в избранном')
 
     @favorite.mapping.delete
     def delete_from_favorite(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        FavoriteSerializer(
-            data={'user': request.user.id, 'recipe': pk},
-            context={'request': request}
-        ).is_valid(raise_exception=True)
-        Favorite.objects.filter(user=request.user, recipe=recipe).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.remove_recipe(Favorite, pk,
+                                  'Рецепт отсутствует в избранном')
 
     @action(
         detail=True,
@@ -155,42 +283,123 @@ class RecipesViewSet(ModelViewSet):
         permission_classes=[IsAuthenticated]
     )
     def shopping_cart(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        serializer = ShoppingCartSerializer(
-            data={'user': request.user.id, 'recipe': pk},
-            context={'request': request}
-        )
-        serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(ShortRecipeSerializer(recipe).data,
-                        status=status.HTTP_201_CREATED)
+        return self.add_recipe(ShoppingCart, pk, 'Рецепт уже в корзине')
 
     @shopping_cart.mapping.delete
     def delete_from_shopping_cart(self, request, pk):
-        recipe = get_object_or_404(Recipe, id=pk)
-        ShoppingCartSerializer(
-            data={'user': request.user.id, 'recipe': pk},
-            context={'request': request}
-        ).is_valid(raise_exception=True)
-        ShoppingCart.objects.filter(user=request.user, recipe=recipe).delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.remove_recipe(ShoppingCart, pk,
+                                  'Рецепт отсутствует в корзине')
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='favorite',
+        permission_classes=[IsAuthenticated],
+    )
+    def bulk_favorite(self, request):
+        return self.change_recipes(Favorite)
+
+    @action(
+        detail=False,
+        methods=['post', 'delete'],
+        url_path='shopping_cart',
+        permission_classes=[IsAuthenticated],
+    )
+    def bulk_shopping_cart(self, request):
+        return self.change_recipes(ShoppingCart)
+
+    @action(
+        detail=False,
+        permission_classes=[IsAuthenticated],
+        pagination_class=PersonalFeedPagination,
+    )
+    def feed(self, request):
+        items = FeedItem.objects.filter(user=request.user)
+        page = self.paginate_queryset(items)
+        ids = [item.recipe_id for item in (items if page is None else page)]
+        recipes = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes], many=True)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, pagination_class=PageNumberPagination)
+    def what_to_cook(self, request):
+        query = WhatToCookSerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        available = set(query.validated_data['ingredients'])
+        queryset = self.filter_queryset(
+            self.get_queryset().covered_by(available))
+        page = self.paginate_queryset(queryset)
+        context = {**self.get_serializer_context(),
+                   'available_ingredients': available}
+        serializer = CookableRecipeSerializer(
+            queryset if page is None else page, many=True, context=context)
+        if page is None:
+            return Response(serializer.data)
+        return self.get_paginated_response(serializer.data)
 
     @action(
         detail=False,
         methods=['get'],
-        permission_classes=[IsAuthenticated]
+        permission_classes=[IsAuthenticated],
+        renderer_classes=SHOPPING_LIST_RENDERERS,
     )
     def download_shopping_cart(self, request):
-        cart = ShoppingCart.objects.filter(user=self.request.user)
-        file = ingredients_in_cart(cart)
-        response = HttpResponse(file, content_type="text/plain")
+        return self.shopping_list_response(
+            shopping_list(request.user, self.get_servings()))
+
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def shopping_cart_summary(self, request):
+        servings = self.get_servings()
+        return Response({
+            'recipes': ShoppingCart.objects.filter(user=request.user).count(),
+            'servings': servings,
+            'ingredients': list(shopping_list(request.user, servings)),
+        })
+
+    def get_servings(self):
+        query = ShoppingListSerializer(data=self.request.query_params)
+        query.is_valid(raise_exception=True)
+        return query.validated_data['servings']
+
+    def shopping_list_response(self, ingredients):
+        renderer = self.request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
         response['Content-Disposition'] = (
-            'attachment; filename=shopping-list.txt'
+            f'attachment; filename=shopping-list.{renderer.format}'
         )
         return response
 
 
-class TagViewSet(ModelViewSet):
+class TagViewSet(ConditionalGetMixin, CachedListMixin, ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = [ReadOnly, ]
+    reference_cache = tags_cache
+    version_cache = tags_cache
+
+
+def internal_request(request):
+    """Whether the request came straight from a private address
+
+    A request passed on by a proxy carries X-Forwarded-For and is not.
+    """
+    if 'HTTP_X_FORWARDED_FOR' in request.META:
+        return False
+    try:
+        address = ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return address.is_private or address.is_loopback
+
+
+def metrics(request):
+    """Prometheus scrape target, served to the internal network only"""
+    if not settings.METRICS_DIR or not internal_request(request):
+        raise Http404
+    return HttpResponse(exposition(), content_type=CONTENT_TYPE)
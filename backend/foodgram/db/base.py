@@ -0,0 +1,89 @@
+import threading
+import time
+from functools import partial
+
+from django.db.backends.postgresql import base
+
+from .pool import ConnectionPool
+
+# a connection unused for longer than this is checked before it is used
+HEALTH_CHECK_IDLE_SECONDS = 1
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+def close_pools():
+    """Close the idle connections of every pool of this process"""
+    with pools_lock:
+        for pool in pools.values():
+            pool.clear()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """PostgreSQL with a per-process pool and connection health checks
+
+    POOL = {'SIZE': n, 'TIMEOUT': seconds} in the database settings makes
+    close() hand connections back to a pool shared by the threads of the
+    process instead of closing them, SIZE 0 turns the pool off. With
+    CONN_HEALTH_CHECKS a persistent or pooled connection that sat idle
+    between requests is checked with SELECT 1 before its next use.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.reused = False
+        self.idle_since = None
+
+    @property
+    def health_checks(self):
+        return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    def get_pool(self, conn_params):
+        options = self.settings_dict.get('POOL') or {}
+        if not options.get('SIZE'):
+            return None
+        key = (self.alias, repr(sorted(conn_params.items())))
+        with pools_lock:
+            if key not in pools:
+                pools[key] = ConnectionPool(
+                    self.alias, options['SIZE'], options.get('TIMEOUT', 10),
+                    check_after=(HEALTH_CHECK_IDLE_SECONDS
+                                 if self.health_checks else None))
+            return pools[key]
+
+    def get_new_connection(self, conn_params):
+        self.idle_since = None
+        self.pool = self.get_pool(conn_params)
+        if self.pool is None:
+            self.reused = False
+            return super().get_new_connection(conn_params)
+        connection, self.reused = self.pool.get(
+            partial(super().get_new_connection, conn_params))
+        self.isolation_level = self.settings_dict['OPTIONS'].get(
+            'isolation_level', connection.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is None or self.pool is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            self.pool.put(self.connection)
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        # called when a request starts and when it ends, the connection
+        # is idle from the first call until it is used again
+        if self.connection is not None and self.idle_since is None:
+            self.idle_since = time.monotonic()
+
+    def ensure_connection(self):
+        if self.connection is not None and self.idle_since is not None:
+            idle = time.monotonic() - self.idle_since
+            self.idle_since = None
+            if (self.health_checks and not self.in_atomic_block
+                    and idle > HEALTH_CHECK_IDLE_SECONDS
+                    and not self.is_usable()):
+                self.close()
+        super().ensure_connection()
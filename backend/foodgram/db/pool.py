@@ -0,0 +1,100 @@
+import threading
+import time
+from collections import deque
+
+from django.dispatch import Signal
+from psycopg2 import Error, OperationalError
+from psycopg2.extensions import (TRANSACTION_STATUS_IDLE,
+                                 TRANSACTION_STATUS_UNKNOWN)
+
+# sent with the seconds spent waiting for a free slot
+pool_wait = Signal()
+# sent when no slot freed up within the timeout
+pool_timeout = Signal()
+
+
+def usable(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except Error:
+        return False
+    return True
+
+
+def discard(connection):
+    try:
+        connection.close()
+    except Error:
+        pass
+
+
+class ConnectionPool:
+    """Connections to one database shared by the threads of a process
+
+    At most size connections are handed out at once, a thread asking for
+    one more waits up to timeout seconds for a slot. Returned connections
+    stay open and are handed out again, newest first; those idle for
+    longer than check_after seconds are checked with SELECT 1 before
+    that, and broken ones are closed.
+    """
+
+    def __init__(self, alias, size, timeout, check_after=None):
+        self.alias = alias
+        self.timeout = timeout
+        self.check_after = check_after
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = deque()
+
+    def get(self, connect):
+        """A connection and whether it was used before"""
+        start = time.perf_counter()
+        if not self.slots.acquire(timeout=self.timeout):
+            pool_timeout.send(sender=self.__class__, alias=self.alias)
+            raise OperationalError(
+                f'Нет свободных соединений с базой данных за {self.timeout} с')
+        pool_wait.send(sender=self.__class__, alias=self.alias,
+                       wait=time.perf_counter() - start)
+        try:
+            while True:
+                with self.lock:
+                    returned = self.idle.pop() if self.idle else None
+                if returned is None:
+                    return connect(), False
+                connection, returned_at = returned
+                if connection.closed:
+                    continue
+                if (self.check_after is None
+                        or time.monotonic() - returned_at <= self.check_after
+                        or usable(connection)):
+                    return connection, True
+                discard(connection)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, connection):
+        try:
+            if (not connection.closed and connection.get_transaction_status()
+                    not in (TRANSACTION_STATUS_IDLE,
+                            TRANSACTION_STATUS_UNKNOWN)):
+                connection.rollback()
+            reusable = (not connection.closed
+                        and connection.get_transaction_status()
+                        == TRANSACTION_STATUS_IDLE)
+        except Error:
+            reusable = False
+        if reusable:
+            with self.lock:
+                self.idle.append((connection, time.monotonic()))
+        else:
+            discard(connection)
+        self.slots.release()
+
+    def clear(self):
+        """Close the idle connections"""
+        with self.lock:
+            idle, self.idle = self.idle, deque()
+        for connection, _ in idle:
+            discard(connection)
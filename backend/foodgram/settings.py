@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -30,6 +31,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -37,9 +39,13 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
-ROOT_URLCONF = 'foodgram.urls'
+# Async views for the hottest read endpoints, set by foodgram.asgi
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False').lower() in ('true', '1', 't')
+
+ROOT_URLCONF = 'foodgram.urls_async' if ASYNC_VIEWS else 'foodgram.urls'
 
 TEMPLATES = [
     {
@@ -58,19 +64,54 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
+ASGI_APPLICATION = 'foodgram.asgi.application'
 
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'foodgram.db',
         'NAME': os.getenv('POSTGRES_DB', 'django'),
         'USER': os.getenv('POSTGRES_USER', 'django'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
         'HOST': os.getenv('DB_HOST', 'localhost'),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.getenv(
+            'CONN_HEALTH_CHECKS', 'True').lower() in ('true', '1', 't'),
+        # connections shared by the threads of a worker, SIZE 0 is off
+        'POOL': {
+            'SIZE': int(os.getenv('DB_POOL_SIZE', 0)),
+            'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        },
     }
 }
 
+# the default cache carries the versions behind the recipe ETags and the
+# token revocations, so with several worker processes it must be shared
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'default'),
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'local',
+    },
+}
+if (int(os.getenv('WEB_CONCURRENCY', 1)) > 1
+        and CACHES['default']['BACKEND'].endswith('.LocMemCache')):
+    raise ImproperlyConfigured(
+        'WEB_CONCURRENCY > 1 требует общего кэша: задайте CACHE_BACKEND '
+        'и CACHE_LOCATION (Memcached или Redis)'
+    )
+
+REFERENCE_CACHE_TIMEOUT = int(os.getenv('REFERENCE_CACHE_TIMEOUT', 300))
+# token to user mapping of api.authentication.TokenAuthentication
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 60))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -102,7 +143,7 @@ AUTH_USER_MODEL = 'users.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.TokenAuthentication',
     ),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json'
 }
@@ -113,6 +154,16 @@ STATIC_ROOT = '/app/static_django/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/app/media/'
 
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+# Share of requests profiled by api.middleware.ProfilingMiddleware, 0 is off
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 500))
+
+# Directory shared by the worker processes for /metrics, empty is off
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1))
+
 DJOSER = {
     'HIDE_USERS': False,
     'LOGIN_FIELD': 'email',
@@ -0,0 +1,10 @@
+from django.urls import include, path
+
+from api import async_views
+
+from . import urls
+
+urlpatterns = [
+    path('api/', include(async_views.urlpatterns)),
+    *urls.urlpatterns,
+]
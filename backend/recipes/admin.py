@@ -1,8 +1,10 @@
 from django.contrib import admin
 
-from recipes.models import Ingredient, Tag, Recipe, RecipeIngredient, Favorite
+from recipes.models import (Ingredient, MeasurementUnit, Tag, Recipe,
+                            RecipeIngredient, Favorite)
 
 admin.site.register(Ingredient)
+admin.site.register(MeasurementUnit)
 admin.site.register(Tag)
 admin.site.register(Recipe)
 admin.site.register(RecipeIngredient)
@@ -0,0 +1,109 @@
+import time
+from collections import Counter
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+SHARED_CACHE = 'default'
+LOCAL_CACHE = 'local'
+
+
+class ReferenceCache:
+    """Versioned cache for read-only reference data
+
+    The version lives in the shared cache, so a bump from any process
+    invalidates every worker. Payloads are stored under a key that
+    includes the version, in the process-local cache first and in the
+    shared cache second.
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.version_key = f'reference:{namespace}:version'
+        self.stats = Counter()
+
+    def scope_key(self, scope):
+        """Version key of a part of the data, such as one recipe
+
+        Scoped versions expire: a lost one starts over with a new value,
+        which only costs the validators of that part.
+        """
+        if scope is None:
+            return self.version_key, None
+        return (f'{self.version_key}:{scope}',
+                settings.REFERENCE_CACHE_TIMEOUT)
+
+    def version(self, scope=None):
+        """Version of the whole data, or of a scope when given"""
+        key, timeout = self.scope_key(scope)
+        shared = caches[SHARED_CACHE]
+        version = shared.get(key)
+        if version is None:
+            shared.add(key, time.time_ns(), timeout=timeout)
+            version = shared.get(key)
+        return version
+
+    def bump(self, *scopes):
+        """Bump the version of the whole data and of the given scopes
+
+        Bumped now and once more when the transaction commits: until the
+        commit other requests still read the old rows and may cache them
+        under the first new version.
+        """
+        self.increment(scopes)
+        transaction.on_commit(lambda: self.increment(scopes))
+
+    def increment(self, scopes):
+        shared = caches[SHARED_CACHE]
+        for scope in (None, *scopes):
+            key, timeout = self.scope_key(scope)
+            try:
+                shared.incr(key)
+            except ValueError:
+                shared.set(key, time.time_ns(), timeout=timeout)
+
+    def make_key(self, key):
+        digest = md5(str(key).encode()).hexdigest()
+        return f'reference:{self.namespace}:{self.version()}:{digest}'
+
+    def get_or_set(self, key, default):
+        key = self.make_key(key)
+        local, shared = caches[LOCAL_CACHE], caches[SHARED_CACHE]
+        value = local.get(key)
+        if value is not None:
+            self.stats['local_hit'] += 1
+            return value
+        value = shared.get(key)
+        if value is None:
+            self.stats['miss'] += 1
+            value = default()
+            shared.set(key, value, settings.REFERENCE_CACHE_TIMEOUT)
+        else:
+            self.stats['shared_hit'] += 1
+        local.set(key, value, settings.REFERENCE_CACHE_TIMEOUT)
+        return value
+
+    def set(self, key, value):
+        key = self.make_key(key)
+        for alias in (LOCAL_CACHE, SHARED_CACHE):
+            caches[alias].set(key, value, settings.REFERENCE_CACHE_TIMEOUT)
+
+
+# scopes of recipes_cache: what one recipe page shows besides the
+# shared reference data
+SHARED_SCOPE = 'shared'
+
+
+def recipe_scope(pk):
+    return f'recipe:{pk}'
+
+
+def user_scope(pk):
+    return f'user:{pk}'
+
+
+tags_cache = ReferenceCache('tags')
+ingredients_cache = ReferenceCache('ingredients')
+recipes_cache = ReferenceCache('recipes')
@@ -11,3 +11,24 @@ COOKING_TIME_MAX_VALUE = 60
 
 AMOUNT_INGREDIENT_MIN_VALUE = 1
 AMOUNT_INGREDIENT_MAX_VALUE = 100
+
+AUTOCOMPLETE_DEFAULT_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+AUTOCOMPLETE_SUBSTRING_MIN_LEN = 3
+
+THUMBNAIL_SIZES = (320, 640)
+THUMBNAIL_QUALITY = 80
+
+SEARCH_CONFIG = 'russian'
+
+WHAT_TO_COOK_MAX_INGREDIENTS = 100
+
+BULK_MAX_ITEMS = 100
+
+# largest primary key of the bigint id columns
+ID_MAX_VALUE = 2 ** 63 - 1
+
+SERVINGS_MIN_VALUE = 1
+SERVINGS_MAX_VALUE = 100
+
+FEED_MAX_LENGTH = 1000
@@ -0,0 +1,46 @@
+from django.contrib.auth import get_user_model
+from django.db.models import (Count, F, OuterRef, PositiveIntegerField,
+                              Subquery)
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Favorite, Recipe, ShoppingCart
+
+User = get_user_model()
+
+# (model, counter field, counted model, its foreign key to model)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+)
+
+
+def change_counter(queryset, field, delta):
+    """Add delta to a counter column in one UPDATE, never below zero"""
+    return queryset.update(**{field: Greatest(
+        F(field) + delta, 0, output_field=PositiveIntegerField()
+    )})
+
+
+def count_subquery(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def reconcile_counters():
+    """Recount every counter, return the number of fixed rows per field"""
+    fixed = {}
+    for model, counter, counted_model, field in COUNTERS:
+        fixed[counter] = model.objects.annotate(
+            actual=count_subquery(counted_model, field)
+        ).exclude(
+            **{counter: F('actual')}
+        ).update(
+            **{counter: count_subquery(counted_model, field)}
+        )
+    return fixed
@@ -0,0 +1,91 @@
+from django.db import connection
+
+from .constants import FEED_MAX_LENGTH
+from .models import FeedItem
+
+PUSH_RECIPE = '''
+INSERT INTO recipes_feeditem (user_id, recipe_id, creation_date)
+SELECT subscribe.user_id, %(recipe)s, %(creation_date)s
+FROM users_subscribe AS subscribe
+WHERE subscribe.author_id = %(author)s
+ON CONFLICT ON CONSTRAINT unique_feed_item DO NOTHING
+'''
+
+BACKFILL = '''
+INSERT INTO recipes_feeditem (user_id, recipe_id, creation_date)
+SELECT subscribe.user_id, recipe.id, recipe.creation_date
+FROM users_subscribe AS subscribe
+CROSS JOIN LATERAL (
+    SELECT id, creation_date FROM recipes_recipe
+    WHERE author_id = subscribe.author_id
+    ORDER BY creation_date DESC, id DESC
+    LIMIT %(limit)s
+) AS recipe
+WHERE {condition}
+ON CONFLICT ON CONSTRAINT unique_feed_item DO NOTHING
+'''
+
+TRIM = '''
+DELETE FROM recipes_feeditem WHERE id IN (
+    SELECT id FROM (
+        SELECT id, ROW_NUMBER() OVER (
+            PARTITION BY user_id
+            ORDER BY creation_date DESC, recipe_id DESC
+        ) AS position
+        FROM recipes_feeditem
+        WHERE {condition}
+    ) AS ranked
+    WHERE position > %(limit)s
+)
+'''
+
+
+def execute(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, {'limit': FEED_MAX_LENGTH, **params})
+        return cursor.rowcount
+
+
+def push_recipe(recipe):
+    """Fan a new recipe out to the feeds of the author's subscribers"""
+    pushed = execute(PUSH_RECIPE, {
+        'recipe': recipe.pk,
+        'creation_date': recipe.creation_date,
+        'author': recipe.author_id,
+    })
+    if pushed:
+        execute(TRIM.format(condition='user_id IN (SELECT user_id FROM '
+                            'users_subscribe WHERE author_id = %(author)s)'),
+                {'author': recipe.author_id})
+    return pushed
+
+
+def backfill(subscription=None):
+    """Fill feeds with the latest recipes of followed authors
+
+    Without a subscription every feed is backfilled.
+    """
+    if subscription is None:
+        pushed = execute(BACKFILL.format(condition='TRUE'), {})
+        execute(TRIM.format(condition='TRUE'), {})
+        return pushed
+    return backfill_subscriptions(subscription.user_id, [subscription.pk])
+
+
+def backfill_subscriptions(user_id, subscription_ids):
+    """Backfill the feed of one user for the given new subscriptions"""
+    pushed = execute(BACKFILL.format(condition='subscribe.id = ANY(%(ids)s)'),
+                     {'ids': list(subscription_ids)})
+    execute(TRIM.format(condition='user_id = %(user)s'), {'user': user_id})
+    return pushed
+
+
+def remove_author(subscription):
+    """Drop the author's recipes from the former subscriber's feed"""
+    return remove_authors(subscription.user_id, [subscription.author_id])
+
+
+def remove_authors(user_id, author_ids):
+    return FeedItem.objects.filter(
+        user=user_id, recipe__author__in=author_ids
+    ).delete()
@@ -0,0 +1,82 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from PIL import Image
+
+from .cache import recipe_scope, recipes_cache
+from .constants import THUMBNAIL_QUALITY, THUMBNAIL_SIZES
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FORMATS = (
+    ('webp', 'WEBP'),
+    ('jpg', 'JPEG'),
+)
+
+executor = None
+
+
+def make_thumbnails(field):
+    """Render every thumbnail size and format of an image field"""
+    storage = field.storage
+    sizes = {}
+    with storage.open(field.name) as file, Image.open(file) as image:
+        # JPEG can decode straight to a reduced scale, much cheaper
+        # than a full decode followed by a resize.
+        image.draft('RGB', (max(THUMBNAIL_SIZES), max(THUMBNAIL_SIZES)))
+        image.load()
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        for size in THUMBNAIL_SIZES:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((size, size))
+            formats = {}
+            for extension, image_format in THUMBNAIL_FORMATS:
+                output = BytesIO()
+                rendered = (thumbnail.convert('RGB')
+                            if image_format == 'JPEG' else thumbnail)
+                rendered.save(output, image_format, quality=THUMBNAIL_QUALITY)
+                formats[extension] = storage.save(
+                    f'thumbnails/{size}/thumbnail.{extension}',
+                    ContentFile(output.getvalue())
+                )
+            sizes[str(size)] = formats
+    return {'source': field.name, 'sizes': sizes}
+
+
+def process_recipe(pk):
+    from .models import Recipe
+
+    try:
+        recipe = Recipe.objects.filter(pk=pk).first()
+        if recipe is None or not recipe.image:
+            return
+        thumbnails = make_thumbnails(recipe.image)
+        if Recipe.objects.filter(pk=pk, image=recipe.image.name).update(
+            thumbnails=thumbnails
+        ):
+            recipes_cache.bump(recipe_scope(pk))
+    except Exception:
+        logger.exception('Не удалось создать миниатюры рецепта %s', pk)
+    finally:
+        if settings.IMAGE_WORKERS:
+            connection.close()
+
+
+def schedule_thumbnails(recipe):
+    """Render thumbnails in the worker pool once the recipe is committed"""
+    global executor
+
+    if not settings.IMAGE_WORKERS:
+        transaction.on_commit(lambda: process_recipe(recipe.pk))
+        return
+    if executor is None:
+        executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='thumbnails'
+        )
+    transaction.on_commit(lambda: executor.submit(process_recipe, recipe.pk))
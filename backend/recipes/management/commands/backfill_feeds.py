@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from recipes.feed import backfill
+
+
+class Command(BaseCommand):
+    help = 'Заполняет ленты подписок последними рецептами авторов'
+
+    def handle(self, *args, **options):
+        pushed = backfill()
+        self.stdout.write(self.style.SUCCESS(
+            f'Добавлено записей в ленты: {pushed}'))
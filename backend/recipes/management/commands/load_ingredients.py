@@ -0,0 +1,176 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.cache import ingredients_cache
+from recipes.constants import (INGREDIENT_NAME_MAX_LEN,
+                               MEASUREMENT_UNIT_NAME_MAX_LEN)
+from recipes.models import Ingredient
+
+DEFAULT_PATH = settings.BASE_DIR.parent / 'data' / 'ingredients.csv'
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            yield row[0], row[-1] if len(row) > 1 else ''
+
+
+def read_json(file):
+    """Yield objects of a top-level JSON array without loading it whole"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = file.read(READ_CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise CommandError('Ожидался JSON-массив ингредиентов')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item.get('name', ''), item.get('measurement_unit', '')
+        if not chunk:
+            if buffer[position:].strip():
+                raise CommandError('Некорректный JSON')
+            return
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
+
+class CopyBuffer:
+    """File-like object feeding rows to COPY ... FROM STDIN as CSV"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.output = io.StringIO()
+        self.writer = csv.writer(self.output)
+
+    def read(self, size=-1):
+        while size < 0 or self.output.tell() < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+        data = self.output.getvalue()
+        if size < 0:
+            size = len(data)
+        self.output = io.StringIO(data[size:])
+        self.output.seek(0, io.SEEK_END)
+        self.writer = csv.writer(self.output)
+        return data[:size]
+
+
+class Command(BaseCommand):
+    help = 'Загружает ингредиенты из CSV или JSON файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=str(DEFAULT_PATH))
+        parser.add_argument(
+            '--format', choices=READERS,
+            help='Формат файла, по умолчанию определяется по расширению'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Не использовать COPY на PostgreSQL'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть положительным')
+        self.rows_read = self.skipped = 0
+        use_copy = (connection.vendor == 'postgresql'
+                    and not options['no_copy'])
+        started = time.monotonic()
+        try:
+            with open(path, encoding='utf-8', newline='') as file:
+                rows = self.clean(READERS[file_format](file))
+                if use_copy:
+                    created = self.copy(rows)
+                else:
+                    created = self.bulk_create(rows, options['batch_size'])
+        except OSError as error:
+            raise CommandError(error)
+        if created:
+            Ingredient.objects.filter(unit=None).link_units()
+            ingredients_cache.bump()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано {self.rows_read} строк, добавлено {created}, '
+            f'пропущено {self.skipped} за {elapsed:.2f} с '
+            f'({self.rows_read / max(elapsed, 1e-6):.0f} строк/с)'
+        ))
+
+    def clean(self, rows):
+        for name, measurement_unit in rows:
+            self.rows_read += 1
+            name, measurement_unit = name.strip(), measurement_unit.strip()
+            if (not name or not measurement_unit
+                    or len(name) > INGREDIENT_NAME_MAX_LEN
+                    or len(measurement_unit) > MEASUREMENT_UNIT_NAME_MAX_LEN):
+                self.skipped += 1
+                continue
+            yield name, measurement_unit
+
+    def bulk_create(self, rows, batch_size):
+        before = Ingredient.objects.count()
+        while True:
+            batch = [
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in islice(rows, batch_size)
+            ]
+            if not batch:
+                break
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+        return Ingredient.objects.count() - before
+
+    def copy(self, rows):
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredients_load '
+                '(name text, measurement_unit text)'
+            )
+            cursor.copy_expert(
+                'COPY ingredients_load (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                CopyBuffer(rows)
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT DISTINCT name, measurement_unit '
+                f'FROM ingredients_load '
+                f'ON CONFLICT ON CONSTRAINT unique_name_measurement_unit '
+                f'DO NOTHING'
+            )
+            created = cursor.rowcount
+            cursor.execute('DROP TABLE ingredients_load')
+        return created
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_recipe
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создает миниатюры для рецептов, у которых их нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересоздать миниатюры всех рецептов'
+        )
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').exclude(image=None)
+        processed = 0
+        for recipe in recipes.only('pk', 'image', 'thumbnails').iterator():
+            if (options['all']
+                    or recipe.thumbnails.get('source') != recipe.image.name):
+                process_recipe(recipe.pk)
+                processed += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано рецептов: {processed}'
+        ))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from recipes.shopping_list import rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает списки покупок по корзинам пользователей'
+
+    def handle(self, *args, **options):
+        items = rebuild_shopping_lists()
+        self.stdout.write(self.style.SUCCESS(
+            f'Позиций в списках покупок: {items}'))
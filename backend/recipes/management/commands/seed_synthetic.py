@@ -0,0 +1,163 @@
+import random
+from datetime import timedelta
+from functools import lru_cache
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import DurationField, ExpressionWrapper, F, Value
+
+from recipes.cache import (SHARED_SCOPE, ingredients_cache, recipes_cache,
+                           tags_cache)
+from recipes.counters import reconcile_counters
+from recipes.feed import backfill
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart, Tag)
+from recipes.shopping_list import rebuild_shopping_lists
+from users.models import Subscribe
+
+User = get_user_model()
+
+# Popularity of the n-th user, recipe or ingredient is proportional
+# to 1 / n ** ZIPF_EXPONENT: a few of them get most of the activity
+ZIPF_EXPONENT = 1.1
+RECIPE_INTERVAL = timedelta(minutes=7)
+
+
+@lru_cache(maxsize=None)
+def zipf_weights(size):
+    return [1 / (rank + 1) ** ZIPF_EXPONENT for rank in range(size)]
+
+
+class Command(BaseCommand):
+    help = 'Создает синтетических пользователей, рецепты и их связи'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--ingredients', type=int, default=2000,
+                            help='Минимальный размер справочника')
+        parser.add_argument('--tags', type=int, default=10,
+                            help='Минимальное количество тегов')
+        parser.add_argument('--ingredients-per-recipe', type=int,
+                            default=8)
+        parser.add_argument('--favorites-per-user', type=int, default=20)
+        parser.add_argument('--carts-per-user', type=int, default=5)
+        parser.add_argument('--subscriptions-per-user', type=int,
+                            default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--prefix', default='synthetic')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            users = self.create_users(options['users'], options['prefix'])
+            ingredients = self.reference(
+                Ingredient, options['ingredients'],
+                lambda i: Ingredient(name=f'Ингредиент {i}',
+                                     measurement_unit='г'))
+            tags = self.reference(
+                Tag, options['tags'],
+                lambda i: Tag(name=f'Тег {i}', slug=f'tag-{i}'))
+            recipes = self.create_recipes(users, options['recipes'])
+            self.link_recipes(recipes, ingredients, tags,
+                              options['ingredients_per_recipe'])
+            for model, per_user in (
+                (Favorite, options['favorites_per_user']),
+                (ShoppingCart, options['carts_per_user']),
+            ):
+                self.bulk_create(model, (
+                    model(user_id=user, recipe_id=recipe)
+                    for user in users
+                    for recipe in self.pick(recipes, per_user)
+                ))
+            self.bulk_create(Subscribe, (
+                Subscribe(user_id=user, author_id=author)
+                for user in users
+                for author in self.pick(
+                    users, options['subscriptions_per_user'])
+                if author != user
+            ))
+            # bulk_create skips the signals that keep derived data current
+            reconcile_counters()
+            Ingredient.objects.filter(unit=None).link_units()
+            if recipes:
+                Recipe.objects.filter(
+                    pk__range=(recipes[0], recipes[-1])
+                ).update_indexes()
+            backfill()
+            rebuild_shopping_lists()
+        for cache in (tags_cache, ingredients_cache):
+            cache.bump()
+        recipes_cache.bump(SHARED_SCOPE)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(users)}, '
+            f'рецептов: {len(recipes)}'
+        ))
+
+    def pick(self, population, count):
+        """Up to count distinct items, popular ones more likely"""
+        if not population:
+            return set()
+        return set(self.random.choices(
+            population, weights=zipf_weights(len(population)), k=count))
+
+    def bulk_create(self, model, objects):
+        return model.objects.bulk_create(
+            objects, batch_size=self.batch_size, ignore_conflicts=True)
+
+    def create_users(self, count, prefix):
+        start = User.objects.filter(username__startswith=prefix).count()
+        password = make_password(None)
+        created = User.objects.bulk_create((
+            User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com',
+                 first_name='Имя', last_name='Фамилия', password=password)
+            for i in range(start, start + count)
+        ), batch_size=self.batch_size)
+        return [user.pk for user in created]
+
+    def reference(self, model, count, make):
+        """Ids of the model, topped up to count rows"""
+        existing = model.objects.count()
+        if existing < count:
+            self.bulk_create(model, (
+                make(i) for i in range(existing, count)))
+        ids = list(model.objects.values_list('pk', flat=True))
+        self.random.shuffle(ids)
+        return ids
+
+    def create_recipes(self, authors, count):
+        created = Recipe.objects.bulk_create((
+            Recipe(
+                author_id=self.random.choices(
+                    authors, weights=zipf_weights(len(authors)))[0],
+                name=f'Рецепт {i}',
+                text=f'Описание рецепта {i}',
+                cooking_time=self.random.randint(1, 60),
+            )
+            for i in range(count)
+        ), batch_size=self.batch_size) if authors else []
+        ids = [recipe.pk for recipe in created]
+        if ids:
+            # spread creation dates, newest last
+            Recipe.objects.filter(pk__range=(ids[0], ids[-1])).update(
+                creation_date=F('creation_date') - ExpressionWrapper(
+                    (Value(ids[-1]) - F('id')) * Value(RECIPE_INTERVAL),
+                    output_field=DurationField()))
+        return ids
+
+    def link_recipes(self, recipes, ingredients, tags, per_recipe):
+        self.bulk_create(RecipeIngredient, (
+            RecipeIngredient(recipe_id=recipe, ingredient_id=ingredient,
+                             amount=self.random.randint(1, 100))
+            for recipe in recipes
+            for ingredient in self.pick(ingredients, per_recipe)
+        ))
+        self.bulk_create(Recipe.tags.through, (
+            Recipe.tags.through(recipe_id=recipe, tag_id=tag)
+            for recipe in recipes
+            for tag in self.pick(tags, 2)
+        ))
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# lower() returns text, so the prefix index needs text_pattern_ops
+# rather than varchar_pattern_ops to serve LIKE 'prefix%'.
+CREATE_PREFIX_INDEX = '''
+CREATE INDEX IF NOT EXISTS ingredient_name_lower_prefix
+ON recipes_ingredient (lower(name) text_pattern_ops);
+'''
+
+# pg_trgm is a contrib extension; skip the substring index on servers
+# that do not ship it, the LIKE '%...%' query still works without it.
+CREATE_TRIGRAM_INDEX = '''
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions
+               WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS ingredient_name_lower_trgm
+        ON recipes_ingredient USING gin (lower(name) gin_trgm_ops);
+    END IF;
+END
+$$;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_alter_recipe_options'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            CREATE_PREFIX_INDEX,
+            'DROP INDEX IF EXISTS ingredient_name_lower_prefix;',
+        ),
+        migrations.RunSQL(
+            CREATE_TRIGRAM_INDEX,
+            'DROP INDEX IF EXISTS ingredient_name_lower_trgm;',
+        ),
+    ]
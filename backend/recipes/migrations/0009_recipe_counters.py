@@ -0,0 +1,36 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:55
+
+from django.db import migrations, models
+
+POPULATE_COUNTERS = '''
+UPDATE recipes_recipe AS recipe SET
+    favorites_count = (SELECT COUNT(*) FROM recipes_favorite
+                       WHERE recipe_id = recipe.id),
+    in_carts_count = (SELECT COUNT(*) FROM recipes_shoppingcart
+                      WHERE recipe_id = recipe.id);
+UPDATE users_user AS author SET
+    recipes_count = (SELECT COUNT(*) FROM recipes_recipe
+                     WHERE author_id = author.id);
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0008_ingredient_name_indexes'),
+        ('users', '0003_user_recipes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в корзину'),
+        ),
+        migrations.RunSQL(POPULATE_COUNTERS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.3 on 2026-10-18 06:05
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+POPULATE_INGREDIENT_IDS = '''
+UPDATE recipes_recipe AS recipe SET ingredient_ids = coalesce((
+    SELECT array_agg(ingredient_id ORDER BY ingredient_id)
+    FROM recipes_recipeingredient
+    WHERE recipe_id = recipe.id
+), '{}');
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0013_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, editable=False, size=None, verbose_name='Идентификаторы ингредиентов'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['ingredient_ids'], name='recipe_ingredient_ids_idx'),
+        ),
+        migrations.RunSQL(POPULATE_INGREDIENT_IDS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.2.3 on 2026-10-18 06:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+POPULATE_SHOPPING_LISTS = '''
+INSERT INTO recipes_shoppinglistitem (user_id, ingredient_id, amount)
+SELECT cart.user_id, ingredient.ingredient_id, SUM(ingredient.amount)
+FROM recipes_shoppingcart AS cart
+JOIN recipes_recipeingredient AS ingredient
+    ON ingredient.recipe_id = cart.recipe_id
+GROUP BY cart.user_id, ingredient.ingredient_id;
+'''
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0015_feeditem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.PositiveIntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_items', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Позиция списка покупок',
+                'verbose_name_plural': 'Списки покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppinglistitem',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_shopping_list_item'),
+        ),
+        migrations.RunSQL(POPULATE_SHOPPING_LISTS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 3.2.3 on 2026-10-18 07:25
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+# spelling: (canonical unit, factor)
+UNITS = {
+    'г': ('г', 1),
+    'г.': ('г', 1),
+    'гр': ('г', 1),
+    'гр.': ('г', 1),
+    'грамм': ('г', 1),
+    'кг': ('г', 1000),
+    'кг.': ('г', 1000),
+    'килограмм': ('г', 1000),
+    'мл': ('мл', 1),
+    'мл.': ('мл', 1),
+    'л': ('мл', 1000),
+    'л.': ('мл', 1000),
+    'литр': ('мл', 1000),
+    'ч. л.': ('мл', 5),
+    'ч.л.': ('мл', 5),
+    'ст. л.': ('мл', 15),
+    'ст.л.': ('мл', 15),
+    'стакан': ('мл', 250),
+    'шт': ('шт.', 1),
+    'шт.': ('шт.', 1),
+    'штука': ('шт.', 1),
+}
+
+LINK_INGREDIENTS = '''
+UPDATE recipes_ingredient AS ingredient SET unit_id = unit.id
+FROM recipes_measurementunit AS unit
+WHERE unit.name = lower(trim(ingredient.measurement_unit));
+'''
+
+
+def add_units(apps, schema_editor):
+    MeasurementUnit = apps.get_model('recipes', 'MeasurementUnit')
+    MeasurementUnit.objects.bulk_create(
+        MeasurementUnit(name=name, canonical_name=canonical_name,
+                        factor=factor)
+        for name, (canonical_name, factor) in UNITS.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_recipe_ingredient_ids_bigint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeasurementUnit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=10, unique=True, verbose_name='Написание')),
+                ('canonical_name', models.CharField(max_length=10, verbose_name='Каноническая единица')),
+                ('factor', models.PositiveIntegerField(validators=[django.core.validators.MinValueValidator(1)], verbose_name='Множитель')),
+            ],
+            options={
+                'verbose_name': 'Единица измерения',
+                'verbose_name_plural': 'Единицы измерения',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='unit',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ingredients', to='recipes.measurementunit', verbose_name='Каноническая единица'),
+        ),
+        migrations.RunPython(add_units, migrations.RunPython.noop),
+        migrations.RunSQL(LINK_INGREDIENTS, migrations.RunSQL.noop),
+    ]
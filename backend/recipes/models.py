@@ -1,18 +1,95 @@
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.aggregates import ArrayAgg, StringAgg
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField)
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db import models
-from django.db.models import UniqueConstraint
+from django.db.models import (BooleanField, Exists, ExpressionWrapper, F,
+                              FloatField, Func, IntegerField, OuterRef,
+                              Prefetch, Subquery, UniqueConstraint, Value,
+                              Window)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import (Cast, Coalesce, Lower, RowNumber,
+                                        Trim)
 
 from .constants import (INGREDIENT_NAME_MAX_LEN, MEASUREMENT_UNIT_NAME_MAX_LEN,
                         TAG_NAME_MAX_LEN, TAG_SLUG_MAX_LEN,
                         RECIPE_NAME_MAX_LEN, COOKING_TIME_MIN_VALUE,
                         COOKING_TIME_MAX_VALUE, AMOUNT_INGREDIENT_MIN_VALUE,
-                        AMOUNT_INGREDIENT_MAX_VALUE)
+                        AMOUNT_INGREDIENT_MAX_VALUE,
+                        AUTOCOMPLETE_SUBSTRING_MIN_LEN, SEARCH_CONFIG)
+from .storage import ContentAddressedStorage
+from users.models import Subscribe
 
 User = get_user_model()
 
 
+class IngredientQuerySet(models.QuerySet):
+    """Ingredients queryset
+
+    Name lookups go through lower(name), which is covered by the
+    text_pattern_ops and pg_trgm indexes from migration 0008.
+    """
+
+    def name_startswith(self, name):
+        return self.annotate(name_lower=Lower('name')).filter(
+            name_lower__startswith=name.lower())
+
+    def autocomplete(self, name, limit):
+        """Prefix matches first, then substring matches, at most limit"""
+        result = list(self.name_startswith(name)[:limit])
+        if len(result) < limit and len(name) >= AUTOCOMPLETE_SUBSTRING_MIN_LEN:
+            result += self.annotate(name_lower=Lower('name')).filter(
+                name_lower__contains=name.lower()
+            ).exclude(
+                name_lower__startswith=name.lower()
+            )[:limit - len(result)]
+        return result
+
+    def link_units(self):
+        """Point the ingredients at the unit their spelling matches"""
+        return self.update(unit=Subquery(MeasurementUnit.objects.filter(
+            name=Lower(Trim(OuterRef('measurement_unit')))
+        ).values('pk')[:1]))
+
+
+class MeasurementUnit(models.Model):
+    """Spelling of a measurement unit and its canonical unit
+
+    The canonical unit is the smallest unit of the same quantity with an
+    integer factor, so кг is 1000 г. Spellings are stored trimmed and in
+    lower case.
+    """
+    name = models.CharField(
+        max_length=MEASUREMENT_UNIT_NAME_MAX_LEN,
+        unique=True,
+        verbose_name='Написание'
+    )
+    canonical_name = models.CharField(
+        max_length=MEASUREMENT_UNIT_NAME_MAX_LEN,
+        verbose_name='Каноническая единица'
+    )
+    factor = models.PositiveIntegerField(
+        validators=[MinValueValidator(1)],
+        verbose_name='Множитель'
+    )
+
+    class Meta:
+        ordering = ['name']
+        verbose_name = 'Единица измерения'
+        verbose_name_plural = 'Единицы измерения'
+
+    def __str__(self):
+        return f'{self.name} = {self.factor} {self.canonical_name}'
+
+    def save(self, *args, **kwargs):
+        self.name = self.name.strip().lower()
+        super().save(*args, **kwargs)
+
+
 class Ingredient(models.Model):
     """Ingredients for recipes"""
     name = models.CharField(
@@ -22,6 +99,17 @@ class Ingredient(models.Model):
         max_length=MEASUREMENT_UNIT_NAME_MAX_LEN,
         verbose_name='Единица измерения'
     )
+    unit = models.ForeignKey(
+        MeasurementUnit,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False,
+        related_name='ingredients',
+        verbose_name='Каноническая единица'
+    )
+
+    objects = IngredientQuerySet.as_manager()
 
     class Meta:
         ordering = ['name']
@@ -64,12 +152,147 @@ class Tag(models.Model):
         return self.name
 
 
+# recipe fields that update_indexes reads besides the ingredients
+INDEXED_FIELDS = {'name', 'text'}
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Recipes queryset"""
+
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+
+    def with_tags(self, tags):
+        """Recipes with any of the tags, without duplicating rows"""
+        return self.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__in=tags)))
+
+    def favorited_by(self, user):
+        if user.is_anonymous:
+            return self.none()
+        return self.filter(Exists(Favorite.objects.filter(
+            user=user, recipe=OuterRef('pk'))))
+
+    def in_cart_of(self, user):
+        if user.is_anonymous:
+            return self.none()
+        return self.filter(Exists(ShoppingCart.objects.filter(
+            user=user, recipe=OuterRef('pk'))))
+
+    def with_tag_ids(self):
+        """Tag ids only; the tags themselves come from the tags cache"""
+        recipe_tags = Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk')
+        ).values('recipe').annotate(ids=ArrayAgg('tag')).values('ids')
+        return self.annotate(tag_ids=Subquery(recipe_tags))
+
+    def search(self, text):
+        """Full-text matches over the stored vector, best ranked first"""
+        query = SearchQuery(text, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return self.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        ).order_by('-search_rank', '-creation_date', '-id')
+
+    def covered_by(self, ingredient_ids):
+        """Recipes using any of the ingredients, best covered first
+
+        Candidates come from the GIN index on ingredient_ids; coverage is
+        the share of a recipe's ingredients found in ingredient_ids.
+        """
+        ingredient_ids = list(ingredient_ids)
+        matched = RawSQL(
+            f'SELECT COUNT(*) FROM unnest({self.model._meta.db_table}'
+            f'.ingredient_ids) AS id WHERE id = ANY(%s)',
+            (ingredient_ids,), output_field=IntegerField()
+        )
+        return self.filter(ingredient_ids__overlap=ingredient_ids).annotate(
+            matched_count=matched,
+            coverage=ExpressionWrapper(
+                Cast('matched_count', FloatField())
+                / Func('ingredient_ids', function='cardinality'),
+                output_field=FloatField()
+            ),
+        ).order_by('-coverage', '-matched_count', '-creation_date', '-id')
+
+    def update_indexes(self):
+        """Rebuild the search vector and the ingredient ids of recipes"""
+        recipe_ingredients = RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk')
+        ).values('recipe')
+        ingredient_names = recipe_ingredients.annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+        ingredient_ids = recipe_ingredients.annotate(
+            ids=ArrayAgg('ingredient', ordering='ingredient')
+        ).values('ids')
+        return self.update(
+            search_vector=(
+                SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                + SearchVector(Subquery(ingredient_names), weight='B',
+                               config=SEARCH_CONFIG)
+                + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+            ),
+            ingredient_ids=Coalesce(
+                Subquery(ingredient_ids), Value([]),
+                output_field=ArrayField(models.BigIntegerField())
+            ),
+        )
+
+    def latest_by_author(self, authors, limit=None):
+        """At most limit newest recipes of every author, in one query"""
+        recipes = self.filter(author__in=authors)
+        if limit is None:
+            return recipes
+        ranked = recipes.annotate(position=Window(
+            RowNumber(),
+            partition_by=F('author'),
+            order_by=(F('creation_date').desc(), F('id').desc()),
+        )).values('pk', 'position')
+        sql, params = ranked.query.sql_with_params()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT id FROM ({sql}) AS ranked WHERE position <= %s',
+            (*params, limit)
+        ))
+
+    def list_prefetches(self, user):
+        """Related rows RecipeListSerializer reads, one query each"""
+        authors = User.objects.all()
+        if user.is_authenticated:
+            authors = authors.annotate(is_subscribed=Exists(
+                Subscribe.objects.filter(user=user, author=OuterRef('pk'))))
+        return (
+            Prefetch('author', queryset=authors),
+            Prefetch(
+                'recipeingredient_set',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient')
+            ),
+        )
+
+    def for_list(self, user):
+        """Everything RecipeListSerializer reads, in a fixed query count"""
+        return self.with_user_flags(user).with_tag_ids().prefetch_related(
+            *self.list_prefetches(user))
+
+
 class Recipe(models.Model):
     """Recipes model"""
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='recipes',
+        db_index=False,
         verbose_name='Автор')
     name = models.CharField(
         max_length=RECIPE_NAME_MAX_LEN,
@@ -88,8 +311,14 @@ class Recipe(models.Model):
     image = models.ImageField(
         'Изображение',
         upload_to='recipes/',
+        storage=ContentAddressedStorage(),
         null=True,
     )
+    thumbnails = models.JSONField(
+        'Миниатюры',
+        default=dict,
+        editable=False,
+    )
     cooking_time = models.PositiveSmallIntegerField(
         'Время приготовления',
         validators=[
@@ -110,9 +339,42 @@ class Recipe(models.Model):
         auto_now_add=True,
         editable=False,
     )
+    favorites_count = models.PositiveIntegerField(
+        'Добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        'Добавлений в корзину',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False,
+    )
+    ingredient_ids = ArrayField(
+        models.BigIntegerField(),
+        verbose_name='Идентификаторы ингредиентов',
+        default=list,
+        editable=False,
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-creation_date']
+        indexes = [
+            models.Index(fields=['-creation_date', '-id'],
+                         name='recipe_creation_date_id_idx'),
+            models.Index(fields=['author', '-creation_date', '-id'],
+                         name='recipe_author_creation_idx'),
+            GinIndex(fields=['search_vector'],
+                     name='recipe_search_vector_idx'),
+            GinIndex(fields=['ingredient_ids'],
+                     name='recipe_ingredient_ids_idx'),
+        ]
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
@@ -216,3 +478,72 @@ class ShoppingCart(UserRecipe):
 
     def __str__(self):
         return f'{self.recipe} в корзине у {self.user}'
+
+
+class ShoppingListItem(models.Model):
+    """Ingredient total over the recipes in the user's cart"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        db_index=False,
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField(
+        verbose_name='Количество',
+    )
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item')
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} в списке покупок {self.user}'
+
+
+class FeedItem(models.Model):
+    """Recipe of a followed author, pushed into the follower's feed"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        db_index=False,
+        verbose_name='Подписчик'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт'
+    )
+    creation_date = models.DateTimeField(
+        verbose_name='Дата создания рецепта',
+    )
+
+    class Meta:
+        ordering = ['-creation_date', '-recipe']
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        constraints = [
+            UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_item')
+        ]
+        indexes = [
+            models.Index(fields=['user', '-creation_date', '-recipe'],
+                         name='feed_user_creation_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
@@ -0,0 +1,102 @@
+from django.db import connection
+
+# Shopping lists are kept summed up per user and ingredient, so reading
+# one is an indexed scan instead of a GROUP BY over the whole cart.
+# A change is a set of (user_id, ingredient_id, amount) rows with the
+# amount signed, applied by the CTEs below in the same statement as the
+# cart change that caused it
+
+APPLY = '''
+list_change AS (
+    {changes}
+), list_deleted AS (
+    DELETE FROM recipes_shoppinglistitem AS item
+    USING list_change AS change
+    WHERE item.user_id = change.user_id
+        AND item.ingredient_id = change.ingredient_id
+        AND item.amount + change.amount <= 0
+), list_updated AS (
+    UPDATE recipes_shoppinglistitem AS item
+    SET amount = item.amount + change.amount
+    FROM list_change AS change
+    WHERE item.user_id = change.user_id
+        AND item.ingredient_id = change.ingredient_id
+        AND item.amount + change.amount > 0
+), list_inserted AS (
+    INSERT INTO recipes_shoppinglistitem (user_id, ingredient_id, amount)
+    SELECT user_id, ingredient_id, amount FROM list_change AS change
+    WHERE amount > 0 AND NOT EXISTS (
+        SELECT 1 FROM recipes_shoppinglistitem AS item
+        WHERE item.user_id = change.user_id
+            AND item.ingredient_id = change.ingredient_id
+    )
+    ON CONFLICT ON CONSTRAINT unique_shopping_list_item DO UPDATE
+    SET amount = recipes_shoppinglistitem.amount + EXCLUDED.amount
+)
+'''
+
+# ingredients of the recipes returned by the {recipes} subquery,
+# {sign} is + for recipes put into the cart and - for removed ones
+RECIPES_CHANGE = '''
+SELECT %(user)s::bigint AS user_id, ingredient_id,
+    {sign}SUM(amount) AS amount
+FROM recipes_recipeingredient
+WHERE recipe_id IN ({recipes})
+GROUP BY ingredient_id
+'''
+
+# ingredient amounts of a recipe changed by the given deltas, applied
+# to every cart the recipe is in
+INGREDIENTS_CHANGE = '''
+SELECT cart.user_id, delta.ingredient_id, SUM(delta.amount) AS amount
+FROM recipes_shoppingcart AS cart
+CROSS JOIN unnest(%(ingredients)s::bigint[], %(amounts)s::bigint[])
+    AS delta (ingredient_id, amount)
+WHERE cart.recipe_id = %(recipe)s
+GROUP BY cart.user_id, delta.ingredient_id
+'''
+
+REBUILD = '''
+INSERT INTO recipes_shoppinglistitem (user_id, ingredient_id, amount)
+SELECT cart.user_id, ingredient.ingredient_id, SUM(ingredient.amount)
+FROM recipes_shoppingcart AS cart
+JOIN recipes_recipeingredient AS ingredient
+    ON ingredient.recipe_id = cart.recipe_id
+GROUP BY cart.user_id, ingredient.ingredient_id
+'''
+
+
+def recipes_change(recipes, removed=False):
+    """CTEs adding or removing the recipes of a subquery for %(user)s"""
+    return APPLY.format(changes=RECIPES_CHANGE.format(
+        sign='-' if removed else '', recipes=recipes))
+
+
+def execute(ctes, params):
+    with connection.cursor() as cursor:
+        cursor.execute(f'WITH {ctes} SELECT 1', params)
+
+
+def change_recipes(user_id, recipe_ids, removed=False):
+    """Add the recipes to the user's list or take them off it"""
+    execute(recipes_change('SELECT unnest(%(recipes)s::bigint[])', removed),
+            {'user': user_id, 'recipes': list(recipe_ids)})
+
+
+def change_ingredients(recipe_id, deltas):
+    """Apply {ingredient_id: amount delta} of a recipe to the lists"""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if deltas:
+        execute(APPLY.format(changes=INGREDIENTS_CHANGE), {
+            'recipe': recipe_id,
+            'ingredients': list(deltas),
+            'amounts': list(deltas.values()),
+        })
+
+
+def rebuild_shopping_lists():
+    """Recompute every shopping list from the carts"""
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM recipes_shoppinglistitem')
+        cursor.execute(REBUILD)
+        return cursor.rowcount
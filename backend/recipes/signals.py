@@ -0,0 +1,221 @@
+from django.db.models import Exists, OuterRef
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_save)
+from django.dispatch import receiver
+
+from .cache import (SHARED_SCOPE, ingredients_cache, recipe_scope,
+                    recipes_cache, tags_cache, user_scope)
+from .counters import COUNTERS, change_counter
+from .feed import backfill, push_recipe, remove_author
+from .images import schedule_thumbnails
+from .models import (INDEXED_FIELDS, Favorite, Ingredient, MeasurementUnit,
+                     Recipe, RecipeIngredient, ShoppingCart, Tag)
+from .shopping_list import change_ingredients, change_recipes
+from users.models import Subscribe
+
+User = get_user_model()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def bump_tags_version(**kwargs):
+    tags_cache.bump()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def bump_ingredients_version(**kwargs):
+    ingredients_cache.bump()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def bump_recipes_version(**kwargs):
+    recipes_cache.bump(SHARED_SCOPE)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def bump_recipe_version(instance, **kwargs):
+    recipes_cache.bump(recipe_scope(instance.pk))
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+def bump_recipe_version_on_related(instance, **kwargs):
+    recipes_cache.bump(recipe_scope(instance.recipe_id))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipe_version_on_tags(instance, reverse, pk_set, **kwargs):
+    if not reverse:
+        recipes_cache.bump(recipe_scope(instance.pk))
+    elif pk_set:
+        recipes_cache.bump(*map(recipe_scope, pk_set))
+    else:
+        recipes_cache.bump(SHARED_SCOPE)
+
+
+@receiver((post_save, post_delete), sender=Subscribe)
+def bump_author_version(instance, **kwargs):
+    recipes_cache.bump(user_scope(instance.author_id))
+
+
+@receiver(post_delete, sender=User)
+def bump_user_version(instance, **kwargs):
+    recipes_cache.bump(user_scope(instance.pk))
+
+
+@receiver(post_save, sender=User)
+def bump_recipes_version_on_profile(instance, update_fields=None, **kwargs):
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        recipes_cache.bump(user_scope(instance.pk))
+
+
+def update_counters(instance, delta):
+    for model, counter, counted_model, field in COUNTERS:
+        if isinstance(instance, counted_model):
+            change_counter(
+                model.objects.filter(pk=getattr(instance, f'{field}_id')),
+                counter, delta
+            )
+
+
+def counted_fields(instance):
+    return [f'{field}_id' for _, _, counted_model, field in COUNTERS
+            if isinstance(instance, counted_model)]
+
+
+@receiver(pre_save, sender=Recipe)
+@receiver(pre_save, sender=Favorite)
+@receiver(pre_save, sender=ShoppingCart)
+def remember_counted_owners(instance, **kwargs):
+    """Owners the counters were given to, for a row that is reassigned"""
+    fields = counted_fields(instance)
+    saved = type(instance).objects.filter(pk=instance.pk).values(
+        *fields).first() if instance.pk else None
+    instance.counted_owners = saved or {}
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def increment_counters(instance, created, **kwargs):
+    if created:
+        update_counters(instance, 1)
+        return
+    for model, counter, counted_model, field in COUNTERS:
+        if not isinstance(instance, counted_model):
+            continue
+        previous = instance.counted_owners.get(f'{field}_id')
+        current = getattr(instance, f'{field}_id')
+        if previous is not None and previous != current:
+            change_counter(model.objects.filter(pk=previous), counter, -1)
+            change_counter(model.objects.filter(pk=current), counter, 1)
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_counters(instance, **kwargs):
+    update_counters(instance, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def update_thumbnails(instance, **kwargs):
+    if (instance.image
+            and instance.thumbnails.get('source') != instance.image.name):
+        schedule_thumbnails(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_indexes(instance, update_fields=None, **kwargs):
+    """Refresh after a save of the indexed fields
+
+    RecipeCreateSerializer sets defer_indexes and refreshes the recipe
+    itself once its ingredients are saved too.
+    """
+    if getattr(instance, 'defer_indexes', False) or (
+            update_fields is not None
+            and not INDEXED_FIELDS & set(update_fields)):
+        return
+    Recipe.objects.filter(pk=instance.pk).update_indexes()
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def update_recipe_ingredients_indexes(instance, **kwargs):
+    """Refresh for rows saved or deleted one by one, as in the admin
+
+    RecipeCreateSerializer changes the rows in bulk without signals and
+    refreshes the recipe once.
+    """
+    Recipe.objects.filter(pk=instance.recipe_id).update_indexes()
+
+
+@receiver(post_save, sender=Ingredient)
+def link_ingredient_unit(instance, update_fields=None, **kwargs):
+    if update_fields is None or 'measurement_unit' in update_fields:
+        Ingredient.objects.filter(pk=instance.pk).link_units()
+
+
+@receiver(post_save, sender=MeasurementUnit)
+def relink_ingredient_units(**kwargs):
+    """A spelling may have been added or changed, relink every ingredient"""
+    Ingredient.objects.link_units()
+
+
+@receiver(post_save, sender=Ingredient)
+def update_renamed_ingredient_indexes(instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(Exists(RecipeIngredient.objects.filter(
+            recipe=OuterRef('pk'), ingredient=instance
+        ))).update_indexes()
+
+
+@receiver(post_save, sender=Recipe)
+def push_to_feeds(instance, created, **kwargs):
+    if created:
+        push_recipe(instance)
+
+
+@receiver(post_save, sender=Subscribe)
+def backfill_feed(instance, created, **kwargs):
+    if created:
+        backfill(instance)
+
+
+@receiver(post_delete, sender=Subscribe)
+def clean_feed(instance, **kwargs):
+    remove_author(instance)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(instance, created, **kwargs):
+    if created:
+        change_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_shopping_list(instance, **kwargs):
+    change_recipes(instance.user_id, [instance.recipe_id], removed=True)
+
+
+@receiver(pre_save, sender=RecipeIngredient)
+def remember_ingredient_amount(instance, **kwargs):
+    instance.saved_amount = RecipeIngredient.objects.filter(
+        pk=instance.pk
+    ).values_list('ingredient_id', 'amount').first() if instance.pk else None
+
+
+@receiver(post_save, sender=RecipeIngredient)
+def update_shopping_lists(instance, **kwargs):
+    deltas = {instance.ingredient_id: instance.amount}
+    if instance.saved_amount is not None:
+        ingredient_id, amount = instance.saved_amount
+        deltas[ingredient_id] = deltas.get(ingredient_id, 0) - amount
+    change_ingredients(instance.recipe_id, deltas)
+
+
+@receiver(post_delete, sender=RecipeIngredient)
+def remove_from_shopping_lists(instance, **kwargs):
+    change_ingredients(instance.recipe_id,
+                       {instance.ingredient_id: -instance.amount})
@@ -0,0 +1,27 @@
+from django.db.models import BigIntegerField, F, Value
+from django.db.models.functions import Cast, Coalesce, Trim
+
+# Measurement units are free text. The MeasurementUnit table maps their
+# spellings to a canonical unit and a factor, and every ingredient keeps
+# a link to the unit its spelling matches, set when it is saved or
+# loaded. Converting is a join on that small table instead of a lookup
+# per row; ingredients with an unknown unit keep it as it is and are
+# only merged with the same spelling.
+
+
+def with_canonical_units(queryset, ingredient, servings=1):
+    """Annotate canonical_unit and the amount converted to it
+
+    `ingredient` is the path to the ingredient of the rows. The amount
+    is multiplied by servings as well.
+    """
+    return queryset.annotate(
+        canonical_unit=Coalesce(F(f'{ingredient}__unit__canonical_name'),
+                                Trim(f'{ingredient}__measurement_unit')),
+        canonical_amount=(
+            Cast('amount', BigIntegerField())
+            * Coalesce(F(f'{ingredient}__unit__factor'), Value(1),
+                       output_field=BigIntegerField())
+            * Value(servings)
+        ),
+    )
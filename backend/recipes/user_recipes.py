@@ -0,0 +1,85 @@
+from django.db import connection
+
+from .counters import COUNTERS
+from .models import Recipe, ShoppingCart
+from .shopping_list import recipes_change
+
+# Favorites and carts are changed in one statement for any number of
+# recipes: the unique constraint settles concurrent requests and the
+# recipe counter and the shopping list are updated in the same
+# statement, as the signals are not sent
+
+ADD = '''
+WITH recipe AS (
+    SELECT id, name, image, thumbnails, cooking_time
+    FROM recipes_recipe WHERE id = ANY(%(recipes)s::bigint[])
+), added AS (
+    INSERT INTO {table} (user_id, recipe_id)
+    SELECT %(user)s, id FROM recipe
+    ON CONFLICT DO NOTHING
+    RETURNING recipe_id
+), counted AS (
+    UPDATE recipes_recipe SET {counter} = {counter} + 1
+    WHERE id IN (SELECT recipe_id FROM added)
+){shopping_list}
+SELECT recipe.*, recipe.id IN (SELECT recipe_id FROM added) AS added
+FROM recipe
+'''
+
+REMOVE = '''
+WITH recipe AS (
+    SELECT id FROM recipes_recipe WHERE id = ANY(%(recipes)s::bigint[])
+), removed AS (
+    DELETE FROM {table}
+    WHERE user_id = %(user)s AND recipe_id IN (SELECT id FROM recipe)
+    RETURNING recipe_id
+), counted AS (
+    UPDATE recipes_recipe SET {counter} = GREATEST({counter} - 1, 0)
+    WHERE id IN (SELECT recipe_id FROM removed)
+){shopping_list}
+SELECT id, id IN (SELECT recipe_id FROM removed) FROM recipe
+'''
+
+
+def format_sql(sql, model):
+    counter, = (counter for owner, counter, counted, _ in COUNTERS
+                if owner is Recipe and counted is model)
+    shopping_list = ''
+    if model is ShoppingCart:
+        removed = sql is REMOVE
+        changed = 'removed' if removed else 'added'
+        shopping_list = ', ' + recipes_change(
+            f'SELECT recipe_id FROM {changed}', removed)
+    return sql.format(table=model._meta.db_table, counter=counter,
+                      shopping_list=shopping_list)
+
+
+def add_recipes(model, user, recipe_ids):
+    """Add the recipes to the user's favorites or cart
+
+    Returns those of them that exist, with `added` set to False for the
+    ones added before.
+    """
+    return list(Recipe.objects.raw(
+        format_sql(ADD, model),
+        {'recipes': list(recipe_ids), 'user': user.pk}
+    ))
+
+
+def add_recipe(model, user, recipe_id):
+    """The added recipe as add_recipes returns it, None if it is missing"""
+    recipes = add_recipes(model, user, [recipe_id])
+    return recipes[0] if recipes else None
+
+
+def remove_recipes(model, user, recipe_ids):
+    """Whether each of the existing recipes was removed, by id"""
+    with connection.cursor() as cursor:
+        cursor.execute(format_sql(REMOVE, model),
+                       {'recipes': list(recipe_ids), 'user': user.pk})
+        return dict(cursor.fetchall())
+
+
+def remove_recipe(model, user, recipe_id):
+    """None if there is no such recipe, else whether it was removed"""
+    return remove_recipes(model, user, [recipe_id]).get(recipe_id)
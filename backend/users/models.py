@@ -31,6 +31,11 @@ class User(AbstractUser):
         verbose_name="Пароль",
         max_length=PASSWORD_MAX_LEN,
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name="Количество рецептов",
+        default=0,
+        editable=False,
+    )
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name', 'password')
@@ -43,6 +48,19 @@ class User(AbstractUser):
     def __str__(self):
         return f'{self.username}: {self.first_name} - {self.last_name}'
 
+    def save(self, *args, update_fields=None, **kwargs):
+        """Leave recipes_count alone unless it is named in update_fields
+
+        The counter is kept by UPDATEs of its own, and the instance being
+        saved, such as the cached request.user, may hold an old value.
+        """
+        if update_fields is None and not self._state.adding:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'recipes_count'
+            ]
+        super().save(*args, update_fields=update_fields, **kwargs)
+
 
 class Subscribe(models.Model):
     """Subscribe to another user"""
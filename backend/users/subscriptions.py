@@ -0,0 +1,58 @@
+from django.db import connection
+
+from recipes.feed import backfill_subscriptions, remove_authors
+
+# Subscriptions to many authors in one statement, feeds are updated
+# explicitly as the signals are not sent
+
+SUBSCRIBE = '''
+WITH author AS (
+    SELECT id FROM users_user WHERE id = ANY(%(authors)s::bigint[])
+), subscribed AS (
+    INSERT INTO users_subscribe (user_id, author_id)
+    SELECT %(user)s, id FROM author
+    ON CONFLICT DO NOTHING
+    RETURNING id, author_id
+)
+SELECT author.id, subscribed.id
+FROM author LEFT JOIN subscribed ON subscribed.author_id = author.id
+'''
+
+UNSUBSCRIBE = '''
+WITH author AS (
+    SELECT id FROM users_user WHERE id = ANY(%(authors)s::bigint[])
+), unsubscribed AS (
+    DELETE FROM users_subscribe
+    WHERE user_id = %(user)s AND author_id IN (SELECT id FROM author)
+    RETURNING author_id
+)
+SELECT id, id IN (SELECT author_id FROM unsubscribed) FROM author
+'''
+
+
+def fetch(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def subscribe_to_authors(user, author_ids):
+    """Whether the user got subscribed to each existing author, by id"""
+    rows = fetch(SUBSCRIBE, {'authors': list(author_ids), 'user': user.pk})
+    subscriptions = [subscription for _, subscription in rows
+                     if subscription is not None]
+    if subscriptions:
+        backfill_subscriptions(user.pk, subscriptions)
+    return {author: subscription is not None
+            for author, subscription in rows}
+
+
+def unsubscribe_from_authors(user, author_ids):
+    """Whether the user got unsubscribed from each existing author"""
+    result = dict(fetch(UNSUBSCRIBE, {'authors': list(author_ids),
+                                      'user': user.pk}))
+    removed = [author for author, unsubscribed in result.items()
+               if unsubscribed]
+    if removed:
+        remove_authors(user.pk, removed)
+    return result